@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+
+# headless batch runner for the solvers
+# nothing in here (or in anything it imports) touches Qt, so it starts fast and
+# runs on machines without a display
+#
+# every (n, seed, time allowance, solver) cell runs in its own process, up to
+# --workers at a time, and each result is written out as soon as its cell finishes
+#
+# example:
+#   python3 BatchRunner.py --sizes 15 30 60 --seeds 101 202 --times 10 60 \
+#     --solvers greedy branchAndBound fancy --workers 16 --output results.csv --json results.jsonl
+
+import argparse
+import csv
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import random
+import sys
+import time
+import traceback
+
+from Instrumentation import SearchStats
+from TSPClasses import Scenario
+from TSPSolver import TSPSolver
+
+data_range = {'x': [-1.5, 1.5], 'y': [-1.0, 1.0]}
+DEFAULT_DIFF = "Hard (Deterministic)"
+
+# the solver entry points on TSPSolver that can be run from the command line
+SOLVERS = ['defaultRandomTour', 'greedy', 'branchAndBound', 'fancy', 'heldKarp']
+# heldKarp is exact but only fits small instances, so it only runs when asked for
+DEFAULT_SOLVERS = ['defaultRandomTour', 'greedy', 'branchAndBound', 'fancy']
+
+RESULT_FIELDS = ['n', 'seed', 'difficulty', 'solver', 'time_allowance',
+                 'cost', 'time', 'count', 'max', 'total', 'pruned', 'status', 'error']
+
+# extra seconds a cell gets past its time allowance before its process is killed
+DEFAULT_GRACE = 30.0
+
+# same points the GUI generates for a seed, as plain (x, y) tuples instead of QPointFs
+def newPoints(seed, npoints):
+  random.seed( seed )
+
+  ptlist = []
+  xr = data_range['x']
+  yr = data_range['y']
+  while len(ptlist) < npoints:
+    x = random.uniform(0.0,1.0)
+    y = random.uniform(0.0,1.0)
+    xval = xr[0] + (xr[1]-xr[0])*x
+    yval = yr[0] + (yr[1]-yr[0])*y
+    ptlist.append( (xval,yval) )
+  return ptlist
+
+# build the scenario for (seed, n), reusing a saved copy from scenario_dir if there is one
+def generateNetwork(seed, n, diff=DEFAULT_DIFF, scenario_dir=None):
+  filename = None
+  if scenario_dir != None:
+    filename = os.path.join(scenario_dir, "{}_{}_{}.tsp".format(diff.replace(" ", "_"), seed, n))
+    if os.path.exists(filename):
+      return Scenario.load(filename)
+
+  points = newPoints(seed, n) # uses current rand seed
+  scenario = Scenario( city_locations=points, difficulty=diff, rand_seed=seed )
+
+  if filename != None:
+    os.makedirs(scenario_dir, exist_ok=True)
+    scenario.save(filename)
+
+  return scenario
+
+# run one solver on one scenario and return a row of RESULT_FIELDS
+# with instrument the row also gets the run's stats (see Instrumentation.SearchStats), which only go to JSON
+def runCell(n, seed, solver_name, time_allowance, diff=DEFAULT_DIFF, scenario_dir=None, instrument=False):
+  scenario = generateNetwork(seed, n, diff, scenario_dir)
+  solver = TSPSolver(None)
+  solver.setupWithScenario(scenario)
+
+  stats = SearchStats() if instrument else None
+  results = getattr(solver, solver_name)(time_allowance=time_allowance, stats=stats)
+
+  row = cellRow(n, seed, solver_name, time_allowance, diff)
+  for field in RESULT_FIELDS[5:11]:
+    row[field] = results.get(field)
+  row['status'] = 'ok'
+  if instrument:
+    row['stats'] = results['stats']
+
+  return row
+
+# a row with just the cell's parameters filled in
+def cellRow(n, seed, solver_name, time_allowance, diff=DEFAULT_DIFF, status=None, error=None):
+  row = dict.fromkeys(RESULT_FIELDS)
+  row.update({'n': n, 'seed': seed, 'difficulty': diff, 'solver': solver_name,
+              'time_allowance': time_allowance, 'status': status, 'error': error})
+  return row
+
+# body of a cell's worker process, the row always goes back through conn
+def _cellProcess(conn, cell):
+  try:
+    row = runCell(**cell)
+  except Exception as e:
+    row = cellRow(cell['n'], cell['seed'], cell['solver_name'], cell['time_allowance'], cell['diff'],
+                  status='error', error=''.join(traceback.format_exception_only(type(e), e)).strip())
+  conn.send(row)
+  conn.close()
+
+# run every cell in its own process, at most `workers` at once
+# a cell that runs past time_allowance + grace is killed and reported with status 'timeout',
+# one that dies without reporting back is reported as 'crashed'; neither affects the other cells
+# on_result is called in this process with each row as soon as its cell is done
+def runGrid(cells, on_result, workers=1, grace=DEFAULT_GRACE):
+  pending = list(cells)
+  pending.reverse()
+  running = {} # result connection -> (process, cell, deadline)
+
+  while pending or running:
+    while pending and len(running) < workers:
+      cell = pending.pop()
+      recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+      process = multiprocessing.Process(target=_cellProcess, args=(send_conn, cell), daemon=True)
+      process.start()
+      send_conn.close()
+      running[recv_conn] = (process, cell, time.time() + cell['time_allowance'] + grace)
+
+    timeout = max(0.0, min(deadline for _, _, deadline in running.values()) - time.time())
+    ready = multiprocessing.connection.wait(list(running.keys()), timeout=timeout)
+
+    for conn in ready:
+      process, cell, _ = running.pop(conn)
+      try:
+        row = conn.recv()
+      except EOFError:
+        process.join()
+        row = cellRow(cell['n'], cell['seed'], cell['solver_name'], cell['time_allowance'], cell['diff'],
+                      status='crashed', error='exit code {}'.format(process.exitcode))
+      conn.close()
+      process.join()
+      on_result(row)
+
+    now = time.time()
+    for conn, (process, cell, deadline) in list(running.items()):
+      if now >= deadline:
+        del running[conn]
+        process.terminate()
+        process.join()
+        conn.close()
+        on_result(cellRow(cell['n'], cell['seed'], cell['solver_name'], cell['time_allowance'], cell['diff'],
+                          status='timeout', error='killed after {:.1f} seconds'.format(cell['time_allowance'] + grace)))
+
+# every (n, seed, time allowance, solver) combination, smallest instances first
+def gridCells(sizes, seeds, times, solvers, diff=DEFAULT_DIFF, scenario_dir=None, instrument=False):
+  cells = []
+  for n in sizes:
+    for seed in seeds:
+      for time_allowance in times:
+        for solver_name in solvers:
+          cells.append({'n': n, 'seed': seed, 'solver_name': solver_name, 'time_allowance': time_allowance,
+                        'diff': diff, 'scenario_dir': scenario_dir, 'instrument': instrument})
+  return cells
+
+# writes each result row to a CSV file and/or a JSON lines file as soon as it arrives
+# so that everything finished so far survives a crash or a kill of the sweep itself
+class ResultWriter():
+  def __init__(self, csv_file=None, json_file=None):
+    self.csv_file = csv_file
+    self.json_file = json_file
+    self.csv_writer = None
+
+    if csv_file != None:
+      self.csv_writer = csv.DictWriter(csv_file, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+      self.csv_writer.writeheader()
+      csv_file.flush()
+
+  def __call__(self, row):
+    if self.csv_writer != None:
+      self.csv_writer.writerow(row)
+      self.csv_file.flush()
+    if self.json_file != None:
+      self.json_file.write(json.dumps(row) + "\n")
+      self.json_file.flush()
+
+def parseArgs(argv):
+  parser = argparse.ArgumentParser(description="Run TSP solvers over a grid of sizes, seeds and time budgets without a GUI.")
+  parser.add_argument('--sizes', type=int, nargs='+', default=[15, 30, 60, 100, 200, 300])
+  parser.add_argument('--seeds', type=int, nargs='+', default=[101, 202, 303, 404, 505])
+  parser.add_argument('--times', type=float, nargs='+', default=[120.0], help="time allowances in seconds")
+  parser.add_argument('--solvers', nargs='+', default=DEFAULT_SOLVERS, choices=SOLVERS)
+  parser.add_argument('--difficulty', default=DEFAULT_DIFF, choices=["Easy", "Normal", "Hard", "Hard (Deterministic)"])
+  parser.add_argument('--scenario-dir', default=None, help="cache generated scenarios in this directory")
+  parser.add_argument('--workers', type=int, default=1, help="number of cells to run at once")
+  parser.add_argument('--grace', type=float, default=DEFAULT_GRACE,
+                      help="seconds past its time allowance before a cell is killed")
+  parser.add_argument('--output', default=None, help="CSV file to write (defaults to stdout)")
+  parser.add_argument('--json', default=None, help="also write results to this JSON lines file")
+  parser.add_argument('--stats', action='store_true',
+                      help="record phase times, rates and the improvement trace of each run into the JSON output")
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parseArgs(argv)
+
+  # build each scenario once up front so the cells can all load it from the cache
+  if args.scenario_dir != None:
+    for n in args.sizes:
+      for seed in args.seeds:
+        generateNetwork(seed, n, args.difficulty, args.scenario_dir)
+
+  csv_file = open(args.output, 'w', newline='') if args.output else sys.stdout
+  json_file = open(args.json, 'w') if args.json else None
+
+  cells = gridCells(args.sizes, args.seeds, args.times, args.solvers, args.difficulty, args.scenario_dir,
+                    args.stats)
+  runGrid(cells, ResultWriter(csv_file, json_file), workers=args.workers, grace=args.grace)
+
+  if csv_file is not sys.stdout:
+    csv_file.close()
+  if json_file != None:
+    json_file.close()
+
+if __name__ == '__main__':
+  main()
@@ -1,76 +1,539 @@
 import numpy as np
+import hashlib
 import math
-import copy
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
+import sys
 import time
-from TSPClasses import TSPSolution
+from collections import OrderedDict
+from Instrumentation import SearchStats
+from ParallelSearch import gatherResults, joinProcesses, newShared, processStats, publishBest, sharedBest
+from TSPClasses import DistanceCache, Scenario, TSPSolution
 
 class BranchSolver():
-  def __init__(self, cities, time_allowance=60.0):
+  # how many states a search processes between calls to checkIn()
+  CHECK_IN_INTERVAL = 256
+  # the parallel search splits the tree into about this many subtrees per worker before handing them out
+  SUBTREES_PER_WORKER = 4
+  BOUNDS = ('reduction', 'assignment')
+  # seconds between checkpoints when a checkpoint_file is given
+  CHECKPOINT_INTERVAL = 5.0
+
+  # distances is the scenario's DistanceCache, looked up from the cities if not given
+  # memory_budget (bytes) turns on the memory-bounded search: queued nodes keep just their path (the
+  # previous_node chain) and bound, and only a limited number of reduced matrices are kept around; the rest are
+  # rebuilt from their nearest ancestor that still has one when the node is expanded.  If the queue alone grows
+  # past the budget the nodes with the worst lower bounds are discarded, which gives up the proof of optimality,
+  # so 'discarded' in the results says how many were dropped
+  # n_workers > 1 runs the search in that many processes (see solveParallel)
+  # bound picks the lower bound nodes are pruned on: 'reduction' (row/column reduction) or 'assignment' (the
+  # reduction plus the assignment-problem bound on top of it, see AssignmentBound)
+  # initial_solution (a TSPSolution, e.g. from the greedy solver) starts the search off as the bssf so pruning
+  # starts straight away instead of after the first dive; initial_bound does the same with just a cost, when
+  # there's no tour to go with it only tours strictly cheaper than it are looked for.  Neither counts towards
+  # 'count' in the results, they're reported as 'initial_cost'
+  # checkpoint_file makes the search save everything it still has to do there every checkpoint_interval seconds
+  # and when it stops, so a run that gets killed can be picked up again with solve(..., resume_from=that file)
+  # stats is an optional Instrumentation.SearchStats to record the run in
+  # on_improvement is called with each new bssf (the initial_solution included) as soon as it's found, and the
+  # search stops early if it returns True
+  def __init__(self, cities, time_allowance=60.0, n_neighbors=Scenario.DEFAULT_NEIGHBORS, distances=None,
+               memory_budget=None, n_workers=1, bound='reduction', initial_solution=None, initial_bound=None,
+               checkpoint_file=None, checkpoint_interval=CHECKPOINT_INTERVAL, stats=None, on_improvement=None):
+    if bound not in self.BOUNDS:
+      raise Exception('Unsupported bound: {}'.format(bound))
+    if checkpoint_file != None and n_workers > 1:
+      raise Exception('Checkpoints are not supported with n_workers > 1')
     self.cities = cities
-    self.bssf = None
+    self.stats = stats if stats != None else SearchStats(enabled=False)
+    if distances == None:
+      distances = DistanceCache.forScenario(cities[0]._scenario)
+    self.distances = distances
+    self.n_neighbors = n_neighbors
+    with self.stats.phase('neighbor lists'):
+      self.neighbors = distances.getNeighbors(n_neighbors)[0]
+    self.branch_orders = {}
+    self.bssf = initial_solution if initial_solution != None and initial_solution.cost < math.inf else None
+    self.initial_bound = initial_bound if initial_bound != None else math.inf
     self.pq = PQ()
     self.root = None
     self.time_allowance = time_allowance
     self.solutions = []
     self.n_states = 0
     self.n_pruned = 0
+    self.memory_budget = memory_budget
+    self.matrix_cache = OrderedDict() # nodes currently holding a matrix in the memory-bounded search
+    self.n_discarded = 0
+    self.peak_memory = 0
+    self.n_workers = n_workers
+    self.bound = bound
+    self.initial_cost = min(self.bssf.cost if self.bssf != None else math.inf, self.initial_bound)
+    self.checkpoint_file = checkpoint_file
+    self.checkpoint_interval = checkpoint_interval
+    self.next_checkpoint = math.inf
+    self.n_previous_solutions = 0 # solutions found before the checkpoint this run resumed from
+    self.n_previous_states = 0
+    self.on_improvement = on_improvement
+    self.stopped = False
 
   # find either an optimal solution or keep running computation until time_allowance is reached
+  # resume_from is a checkpoint file to carry on from instead of starting at the root, it gets the full
+  # time_allowance again
   # O(n!) time
   # O(n!) space
-  def solve(self, start_index):
-    self.root = Node(solver=self).fromCities(self.cities)
-    self.root.index = start_index
+  def solve(self, start_index, resume_from=None):
+    if self.bssf != None:
+      self.reportImprovement(self.bssf)
+
+    if self.n_workers > 1:
+      if resume_from != None:
+        raise Exception('Checkpoints are not supported with n_workers > 1')
+      return self.solveParallel(start_index)
 
-    self.pq.insert(self.root)
+    if resume_from != None:
+      self.loadCheckpoint(resume_from, start_index)
+    else:
+      self.setupRoot(start_index)
+      self.pq.insert(self.root)
 
     start_time = time.time()
 
-    while len(self.pq) > 0 and time.time() - start_time < self.time_allowance:
-      node = self.pq.pop()
-      self.n_states += 1
+    if self.checkpoint_file != None:
+      self.next_checkpoint = start_time + self.checkpoint_interval
 
-      # prune the node if its lower bound is greater than the bssf
-      if self.bssf != None and node.lower_bound >= self.bssf.cost:
-        self.n_pruned += 1
-        continue
+    self.search(start_time + self.time_allowance)
 
-      new_node = None
+    if self.checkpoint_file != None:
+      self.writeCheckpoint()
 
-      # check for edges leading away from the current node and add them to the pq
-      for i in range(len(node.matrix)):
-        if node.matrix[node.index][i] != np.inf:
-          new_node = Node().fromNode(node, i)
-          self.pq.insert(new_node)
+    return self.results(time.time() - start_time)
 
-      # if there are no more paths left to explore this means we've found a possible solution
-      # we're going to check it for completeness and check it against the bssf
-      if new_node == None:
-        route = node.getCityBacktrace()
+  def setupRoot(self, start_index):
+    with self.stats.phase('root'):
+      self.root = Node(solver=self).fromCities(self.cities)
+    self.root.index = start_index
 
-        # make sure that all cities are present on the route
-        # if not don't consider it as a solution beacause we've just hit a dead end
-        if len(route) == len(self.cities):
-          solution = TSPSolution(route)
-          self.solutions.append(solution)
+    # rough sizes used for the memory accounting
+    self.matrix_bytes = self.root.matrix.nbytes
+    self.node_bytes = sys.getsizeof(self.root) + sys.getsizeof(self.root.__dict__)
+    if self.root.assignment != None:
+      self.node_bytes += sum(array.nbytes for array in self.root.assignment.__dict__.values()
+                             if isinstance(array, np.ndarray))
+    if self.memory_budget != None:
+      # half the budget goes to cached matrices, but never fewer than a handful
+      self.cache_capacity = max(4, self.memory_budget // (2 * self.matrix_bytes))
+
+  # expand nodes off the pq until it is empty or the deadline passes
+  def search(self, deadline):
+    while len(self.pq) > 0 and not self.stopped and time.time() < deadline:
+      # between states everything left to do is on the pq
+      if time.time() >= self.next_checkpoint:
+        with self.stats.phase('checkpoint'):
+          self.writeCheckpoint()
+
+      with self.stats.phase('queue'):
+        node = self.pq.pop()
+      self.n_states += 1
 
-          if self.bssf is None or solution.cost < self.bssf.cost:
-            self.bssf = solution
-            self.n_pruned += self.pq.prune(self.bssf)
+      if self.n_states % self.CHECK_IN_INTERVAL == 0:
+        self.checkIn()
 
-    time_elapsed = time.time() - start_time
+      # prune the node if its lower bound is greater than the bssf
+      if node.lower_bound >= self.boundCost():
+        self.n_pruned += 1
+        continue
 
+      self.expand(node)
+
+  # put node's children on the pq, or if it has none check whether it completes a tour
+  def expand(self, node):
+    new_node = None
+
+    if self.memory_budget != None or node.matrix is None:
+      with self.stats.phase('restore'):
+        self.restoreMatrix(node)
+
+    # check for edges leading away from the current node and add them to the pq
+    order = self.branchOrder(node.index)
+    children = []
+    for i in order[node.matrix[node.index, order] != np.inf]:
+      new_node = Node().fromNode(node, i)
+      with self.stats.phase('queue'):
+        self.pq.insert(new_node)
+      children.append(new_node)
+
+    if self.memory_budget != None:
+      # the first child is the next one popped, so it goes into the cache last
+      for child in reversed(children):
+        self.cacheMatrix(child)
+      self.enforceBudget()
+    elif node is not self.root:
+      # the children have their own copies now and nothing expands node again, so its matrix would only sit
+      # there for as long as any of its descendants is queued; that way the matrices held are the queued
+      # nodes' (and the root's, which the parallel search starts its subtrees from)
+      node.matrix = None
+
+    # if there are no more paths left to explore this means we've found a possible solution
+    # we're going to check it for completeness and check it against the bssf
+    if new_node == None:
+      route = node.getIndexBacktrace()
+
+      # make sure that all cities are present on the route
+      # if not don't consider it as a solution beacause we've just hit a dead end
+      if len(route) == len(self.cities):
+        solution = TSPSolution.fromPermutation(self.distances.getScenario(), route)
+        self.solutions.append(solution)
+
+        if solution.cost < self.boundCost():
+          self.foundSolution(solution)
+
+    return children
+
+  # the cost a node's lower bound has to beat to be worth expanding
+  def boundCost(self):
+    return min(self.bssf.cost if self.bssf != None else math.inf, self.initial_bound)
+
+  # called with each solution that beats boundCost()
+  def foundSolution(self, solution):
+    self.bssf = solution
+    self.stats.improvement(solution.cost, states=self.n_states)
+    with self.stats.phase('queue'):
+      self.n_pruned += self.pq.prune(self.bssf.cost)
+    self.reportImprovement(solution)
+
+  # hand a new bssf to on_improvement, which can ask for the search to stop
+  def reportImprovement(self, solution):
+    if self.on_improvement != None and self.on_improvement(solution):
+      self.stopped = True
+
+  # called every CHECK_IN_INTERVAL states, for searches that need to look outside themselves now and then
+  def checkIn(self):
+    pass
+
+  def results(self, time_elapsed):
     results = {}
     results['cost'] = self.bssf.cost if self.bssf else math.inf
     results['time'] = time_elapsed
-    results['count'] = len(self.solutions)
+    results['count'] = self.n_previous_solutions + len(self.solutions)
     results['soln'] = self.bssf
     results['max'] = self.pq.max_size
     results['total'] = self.n_states
     results['pruned'] = self.n_pruned
+    # estimated bytes held by queued nodes and their matrices at the fullest point of the search; expanded nodes
+    # let go of their matrices (see expand), so all that's left out is their small Node objects
+    results['peak_memory'] = self.peak_memory if self.memory_budget != None else \
+      self.pq.max_size * (self.node_bytes + self.matrix_bytes)
+    results['discarded'] = self.n_discarded
+    # what the search started out having to beat, math.inf without a warm start
+    results['initial_cost'] = self.initial_cost
+    self.stats.setCount('expansions', self.n_states - self.n_previous_states)
+    self.stats.setCount('pruned', self.n_pruned)
+    results['stats'] = self.stats.toDict()
+
+    return results
+
+  # the node reached by following path (a list of city indices starting at the root's) from the root
+  def nodeForPath(self, path):
+    node = self.root
+    for index in path[1:]:
+      node = Node().fromNode(node, index)
+    return node
+
+  # the same search spread over n_workers processes
+  # the tree is split by expanding its first levels here, breadth first, until there are about
+  # SUBTREES_PER_WORKER subtrees per worker; those go on a shared task queue as paths from the root.  Workers
+  # share the best cost found so far through shared memory so every one of them prunes with it, and a worker
+  # that notices others sitting idle hands part of its own queue back out as new subtrees
+  def solveParallel(self, start_index):
+    start_time = time.time()
+    deadline = start_time + self.time_allowance
+
+    self.setupRoot(start_index)
+
+    # split: breadth first expansion of the top of the tree
+    frontier = [self.root]
+    while 0 < len(frontier) < self.n_workers * self.SUBTREES_PER_WORKER and not self.stopped and \
+          time.time() < deadline:
+      node = frontier.pop(0)
+      self.n_states += 1
+      if node.lower_bound >= self.boundCost():
+        self.n_pruned += 1
+        continue
+      frontier.extend(self.expand(node))
+    frontier.sort(key=lambda node: node.lower_bound)
+    # expand() queued the frontier here as well, the workers take it from now on
+    self.pq = PQ()
 
+    shared = newShared(len(self.cities), self.boundCost(), self.bssf.perm if self.bssf != None else None,
+                       idle=multiprocessing.RawValue('i', 0),
+                       outstanding=multiprocessing.RawValue('i', len(frontier)),
+                       tasks=multiprocessing.Queue())
+    for node in frontier:
+      shared['tasks'].put(node.getIndexBacktrace() + [node.index])
+
+    settings = {'time_allowance': self.time_allowance, 'n_neighbors': self.n_neighbors,
+                'memory_budget': self.memory_budget, 'bound': self.bound, 'stats': processStats(self.stats)}
+    workers = []
+    for _ in range(self.n_workers if len(frontier) > 0 and not self.stopped else 0):
+      worker = multiprocessing.Process(target=runBranchWorker, daemon=True,
+                                       args=(self.distances.getScenario(), start_index, deadline, settings, shared))
+      worker.start()
+      workers.append(worker)
+
+    # gather every worker's counters, then throw away whatever subtrees were left when time ran out
+    # while waiting, pass any better tour the workers have published on to on_improvement
+    totals = {'max': self.pq.max_size, 'count': len(self.solutions)}
+    def addWorker(stats):
+      self.n_states += stats['total']
+      self.n_pruned += stats['pruned']
+      self.n_discarded += stats['discarded']
+      self.peak_memory += stats['peak_memory']
+      totals['max'] += stats['max']
+      totals['count'] += stats['count']
+      self.stats.merge(stats['stats'])
+    gatherResults(shared, workers, deadline, addWorker, lambda: self.collectShared(shared),
+                  poll=self.on_improvement != None)
+    while not shared['tasks'].empty():
+      shared['tasks'].get()
+    joinProcesses(workers)
+    max_size = totals['max']
+    n_solutions = totals['count']
+
+    results = self.results(time.time() - start_time)
+    # summed over the workers
+    results['max'] = max_size
+    results['count'] = n_solutions
+    if self.memory_budget == None:
+      results['peak_memory'] = max_size * (self.node_bytes + self.matrix_bytes)
     return results
 
+  # take the workers' best tour as the bssf if it's better, and tell the workers to stop if on_improvement says so
+  def collectShared(self, shared):
+    solution = sharedBest(shared, self.distances.getScenario(), self.boundCost())
+    if solution != None:
+      self.bssf = solution
+      self.reportImprovement(self.bssf)
+      if self.stopped:
+        shared['stop'].value = 1
+
+  # estimated bytes held by the memory-bounded search right now
+  def memoryUsed(self):
+    return len(self.pq) * self.node_bytes + len(self.matrix_cache) * self.matrix_bytes
+
+  # keep node's freshly computed matrix in the cache, dropping the least recently used one if it's full
+  # the root's matrix is never dropped, every rebuild can start from it
+  def cacheMatrix(self, node):
+    self.matrix_cache[node] = True
+    self.matrix_cache.move_to_end(node)
+
+    while len(self.matrix_cache) > self.cache_capacity:
+      old_node = self.matrix_cache.popitem(last=False)[0]
+      if old_node is self.root:
+        self.matrix_cache[old_node] = True
+      else:
+        old_node.matrix = None
+
+  # make sure node has its reduced matrix, replaying the edges from its nearest ancestor that still has one
+  # (nodes loaded from a checkpoint start out without their bounds as well, and get those back the same way)
+  def restoreMatrix(self, node):
+    if node.matrix is None:
+      path = []
+      ancestor = node
+      while ancestor.matrix is None:
+        path.append(ancestor)
+        ancestor = ancestor.previous_node
+
+      replay = ancestor
+      for step in reversed(path):
+        replay = Node().fromNode(replay, step.index)
+        if step is node:
+          step.matrix = replay.matrix
+          step.reduction_bound = replay.reduction_bound
+          step.assignment = replay.assignment
+
+    if self.memory_budget != None:
+      self.cacheMatrix(node)
+
+  # identifies the scenario and bound a checkpoint belongs to
+  def fingerprint(self):
+    digest = hashlib.sha1(np.ascontiguousarray(self.distances.costs).tobytes()).hexdigest()
+    return '{}:{}'.format(self.bound, digest)
+
+  # save the queued nodes, the bssf and the counters to checkpoint_file
+  # queued nodes are saved as the tree of their paths from the root (each tree node a parent and a city), in
+  # the order they went on the pq; their matrices are left out and rebuilt when a resumed search expands them
+  # O(q + t) time for q queued nodes with t ancestors between them
+  def writeCheckpoint(self):
+    positions = {}
+    parents = []
+    cities = []
+    frontier = []
+    bounds = []
+
+    for node in self.pq.nodes():
+      # number the ancestors not numbered yet, root first
+      path = []
+      ancestor = node
+      while ancestor != None and ancestor not in positions:
+        path.append(ancestor)
+        ancestor = ancestor.previous_node
+      for step in reversed(path):
+        positions[step] = len(parents)
+        parents.append(positions[step.previous_node] if step.previous_node != None else -1)
+        cities.append(step.index)
+
+      frontier.append(positions[node])
+      bounds.append(node.lower_bound)
+
+    # write to a temporary file first so a kill part way through leaves the last checkpoint intact
+    temp_file = self.checkpoint_file + '.tmp'
+    with open(temp_file, 'wb') as f:
+      np.savez(f, fingerprint=np.array(self.fingerprint()), start_index=self.root.index,
+               parents=np.array(parents, dtype=np.int32), cities=np.array(cities, dtype=np.int32),
+               frontier=np.array(frontier, dtype=np.int32), bounds=np.array(bounds, dtype=float),
+               bssf=np.array(self.bssf.perm if self.bssf != None else [], dtype=np.int32),
+               initial_bound=self.initial_bound, n_states=self.n_states, n_pruned=self.n_pruned,
+               n_solutions=self.n_previous_solutions + len(self.solutions), n_discarded=self.n_discarded,
+               max_size=self.pq.max_size)
+    os.replace(temp_file, self.checkpoint_file)
+
+    self.next_checkpoint = time.time() + self.checkpoint_interval
+
+  # set the search back up from a checkpoint written by writeCheckpoint
+  def loadCheckpoint(self, filename, start_index):
+    with np.load(filename) as checkpoint:
+      if str(checkpoint['fingerprint']) != self.fingerprint():
+        raise Exception('Checkpoint {} is for a different scenario or bound'.format(filename))
+      if int(checkpoint['start_index']) != start_index:
+        raise Exception('Checkpoint {} starts from city {}, not {}'.format(filename, int(checkpoint['start_index']),
+                                                                          start_index))
+
+      self.setupRoot(start_index)
+
+      nodes = []
+      for parent, city in zip(checkpoint['parents'].tolist(), checkpoint['cities'].tolist()):
+        nodes.append(self.root if parent < 0 else Node().lightFromNode(nodes[parent], city))
+      for position, lower_bound in zip(checkpoint['frontier'].tolist(), checkpoint['bounds'].tolist()):
+        nodes[position].lower_bound = lower_bound
+        self.pq.insert(nodes[position])
+      self.pq.max_size = max(self.pq.max_size, int(checkpoint['max_size']))
+
+      if len(checkpoint['bssf']) > 0:
+        solution = TSPSolution.fromPermutation(self.distances.getScenario(), checkpoint['bssf'])
+        if solution.cost < self.boundCost():
+          self.bssf = solution
+      self.initial_bound = min(self.initial_bound, float(checkpoint['initial_bound']))
+      self.n_states = int(checkpoint['n_states'])
+      self.n_previous_states = self.n_states
+      self.n_pruned = int(checkpoint['n_pruned'])
+      self.n_previous_solutions = int(checkpoint['n_solutions'])
+      self.n_discarded = int(checkpoint['n_discarded'])
+
+  # record the peak and, once over budget, shrink the matrix cache and then drop the worst queued nodes
+  def enforceBudget(self):
+    used = self.memoryUsed()
+    self.peak_memory = max(self.peak_memory, used)
+
+    if used > self.memory_budget:
+      self.cache_capacity = max(4, self.cache_capacity // 2)
+      self.cacheMatrix(self.root)
+
+      excess = self.memoryUsed() - int(0.9 * self.memory_budget)
+      if excess > 0:
+        self.n_discarded += self.pq.discardWorst(excess // self.node_bytes + 1)
+
+  # the order to branch on the edges leaving city index
+  # its nearest neighbors go in first so the depth first dive follows the cheap edges and finds a good bssf early,
+  # every other city still follows so no branch is left out of the search
+  def branchOrder(self, index):
+    if index not in self.branch_orders:
+      nearest = self.neighbors[index]
+      nearest = nearest[nearest >= 0]
+      rest = np.setdiff1d(np.arange(len(self.cities)), nearest)
+      self.branch_orders[index] = np.concatenate((nearest, rest))
+    return self.branch_orders[index]
+
+# one process of the parallel search, see BranchSolver.solveParallel
+# it runs the subtrees it takes off the shared task queue with the ordinary search, pruning against the shared
+# best cost and publishing any better tour it finds
+class BranchWorker(BranchSolver):
+  def __init__(self, cities, shared, **settings):
+    super().__init__(cities, **settings)
+    self.shared = shared
+    self.best_cost = shared['best_cost'].value
+
+  def boundCost(self):
+    return self.best_cost
+
+  def foundSolution(self, solution):
+    if publishBest(self.shared, solution):
+      self.stats.improvement(solution.cost, states=self.n_states)
+    self.best_cost = min(self.best_cost, self.shared['best_cost'].value)
+    self.bssf = solution
+    self.n_pruned += self.pq.prune(self.best_cost)
+
+  # pick up improvements from the other workers, and share work if some of them have run dry
+  def checkIn(self):
+    shared = self.shared
+    self.stopped = shared['stop'].value != 0
+    best_cost = shared['best_cost'].value
+    if best_cost < self.best_cost:
+      self.best_cost = best_cost
+      self.n_pruned += self.pq.prune(best_cost)
+
+    if shared['idle'].value > 0 and len(self.pq) > 1:
+      donated = self.pq.takeShallowest(min(shared['idle'].value, len(self.pq) // 2))
+      with shared['lock']:
+        shared['outstanding'].value += len(donated)
+      for node in donated:
+        shared['tasks'].put(node.getIndexBacktrace() + [node.index])
+
+  def run(self, start_index, deadline):
+    shared = self.shared
+    shared['tasks'].cancel_join_thread()
+    self.setupRoot(start_index)
+
+    idle = False
+    while time.time() < deadline and not shared['stop'].value:
+      try:
+        path = shared['tasks'].get(timeout=0.01)
+      except queue.Empty:
+        with shared['lock']:
+          if shared['outstanding'].value == 0:
+            break
+          if not idle:
+            shared['idle'].value += 1
+            idle = True
+        continue
+
+      if idle:
+        with shared['lock']:
+          shared['idle'].value -= 1
+        idle = False
+
+      self.checkIn()
+      self.pq.insert(self.nodeForPath(path))
+      self.search(deadline)
+
+      # anything still queued here is abandoned at the deadline, so the subtree counts as done either way
+      with shared['lock']:
+        shared['outstanding'].value -= 1
+
+    if idle:
+      with shared['lock']:
+        shared['idle'].value -= 1
+
+    results = self.results(0.0)
+    del results['soln']
+    shared['results'].put(results)
+
+def runBranchWorker(scenario, start_index, deadline, settings, shared):
+  worker = BranchWorker(scenario.getCities(), shared, **settings)
+  worker.run(start_index, deadline)
+
 class Node():
   def __init__(self, solver=None):
     self.cost = 0
@@ -81,28 +544,40 @@ class Node():
     self.index = None
     self.solver = solver
     self.level = None
+    # lower_bound is what the search prunes on; reduction_bound is the plain row/column reduction part of it,
+    # which is what children build on (the two differ only with the assignment bound)
+    self.reduction_bound = 0
+    self.assignment = None
 
   # create a root node from a list of cities
   def fromCities(self, cities):
     self.cities = cities
     self.level = 0
 
-    matrix = []
+    # the scenario's cost matrix already has inf for self-edges and missing edges
+    # it's shared (read-only) by every run on the scenario, so only the matrix we reduce gets copied
+    self.original_matrix = self.solver.distances.costs
+    self.matrix = np.array(self.original_matrix, dtype=float)
 
-    for i, c1 in enumerate(cities):
-      row = []
-      for j, c2 in enumerate(cities):
-        if i == j:
-          row.append(np.inf)
-        else:
-          row.append(c1.costTo(c2))
-      matrix.append(row)
+    self.reduce()
+    self.reduction_bound = self.lower_bound
 
-    self.matrix = matrix
+    if self.solver.bound == 'assignment':
+      self.assignment = AssignmentBound().fromMatrix(self.matrix)
+      self.lower_bound += self.assignment.value
 
-    self.original_matrix = copy.deepcopy(self.matrix)
+    return self
 
-    self.reduce()
+  # a node for the edge source_node -> dest_index with nothing computed yet, as loaded from a checkpoint
+  # BranchSolver.restoreMatrix fills in its matrix and bounds when it's expanded
+  def lightFromNode(self, source_node, dest_index):
+    self.original_matrix = source_node.original_matrix
+    self.previous_node = source_node
+    self.index = dest_index
+    self.cities = source_node.cities
+    self.solver = source_node.solver
+    self.level = source_node.level + 1
+    self.reduction_bound = None
 
     return self
 
@@ -112,15 +587,23 @@ class Node():
   def fromNode(self, source_node, dest_index):
     self.index = dest_index
     self.original_matrix = source_node.original_matrix
-    self.matrix = copy.deepcopy(source_node.matrix)
+    self.matrix = source_node.matrix.copy()
     self.cost = source_node.cost
-    self.lower_bound = source_node.lower_bound
+    self.lower_bound = source_node.reduction_bound
     self.previous_node = source_node
-    self.addEdge(source_node.index, dest_index)
+    with source_node.solver.stats.phase('reduction'):
+      row_reduction, col_reduction = self.addEdge(source_node.index, dest_index)
+    self.reduction_bound = self.lower_bound
     self.cities = source_node.cities
     self.solver = source_node.solver
     self.level = source_node.level + 1
 
+    if source_node.assignment != None:
+      with self.solver.stats.phase('assignment'):
+        self.assignment = AssignmentBound().fromParent(source_node.assignment, self.matrix, row_reduction,
+                                                       col_reduction, source_node.index, dest_index)
+      self.lower_bound += self.assignment.value
+
     return self
 
   def __str__(self):
@@ -138,58 +621,46 @@ class Node():
 
   # infinity out the row and column of the matrix as well as the appropriate entries
   # after adding an edge, then reduce the matrix
+  # returns the row and column reductions
   # O(n**2) time
   def addEdge(self, src_index, dest_index):
-    self.cost += self.original_matrix[src_index][dest_index]
-    self.lower_bound += self.matrix[src_index][dest_index]
+    self.cost += self.original_matrix[src_index, dest_index]
+    self.lower_bound += self.matrix[src_index, dest_index]
 
-    for i in range(len(self.matrix)):
-      self.matrix[i][dest_index] = np.inf
-      self.matrix[src_index][i] = np.inf
+    self.matrix[:, dest_index] = np.inf
+    self.matrix[src_index, :] = np.inf
+    self.matrix[dest_index, src_index] = np.inf
 
-    self.matrix[src_index][dest_index] = np.inf
-    self.matrix[dest_index][src_index] = np.inf
-
-    self.reduce()
+    return self.reduce()
 
 
   # make the reduction calculations on the reduction matrix
+  # rows and columns that are all inf are left alone
   # O(n**2) time
+  # returns the amounts taken off each row and each column
   def reduce(self):
     # reduce rows
-    for row in self.matrix:
-      smallest = min(row)
+    row_smallest = np.minimum.reduce(self.matrix, axis=1)
+    row_smallest[row_smallest == np.inf] = 0
+    self.lower_bound += np.add.reduce(row_smallest)
+    self.matrix -= row_smallest[:, np.newaxis]
 
-      if smallest != np.inf:
-        self.lower_bound += smallest
+    # reduce columns
+    col_smallest = np.minimum.reduce(self.matrix, axis=0)
+    col_smallest[col_smallest == np.inf] = 0
+    self.lower_bound += np.add.reduce(col_smallest)
+    self.matrix -= col_smallest
 
-      for i in range(len(row)):
-        if row[i] != np.inf:
-          row[i] = row[i]-smallest
+    return row_smallest, col_smallest
 
-    # reduce columns
-    for i in range(len(self.matrix)):
-      # get column min
-      smallest = np.inf
-      for row in self.matrix:
-        if row[i] < smallest:
-          smallest = row[i]
-
-      if smallest != np.inf:
-        self.lower_bound += smallest
-
-      for row in self.matrix:
-        if row[i] != np.inf:
-          row[i] = row[i]-smallest
-
-  # return a list of cities leading up to the current node for use in making a TSPSolution object
-  def getCityBacktrace(self):
+  # return the indices of the cities leading up to the current node for use in making a TSPSolution object
+  def getIndexBacktrace(self):
     output = []
 
     city = self.previous_node
 
     while city != None:
-      output.append(self.cities[city.index])
+      output.append(city.index)
       city = city.previous_node
 
     output.reverse()
@@ -201,47 +672,202 @@ class Node():
   def score(self):
     return self.level
 
+# the assignment-problem bound on top of a node's reduced matrix
+# every way of finishing the tour from a node uses exactly one more edge out of each city it hasn't left yet and
+# one more edge into each city it hasn't entered yet, so the cheapest such assignment (ignoring subtours) on the
+# reduced matrix is a valid addition to the reduction bound, and usually a much bigger one than 0 on the
+# asymmetric instances.  The assignment is found with shortest augmenting paths (the Hungarian method), keeping
+# the dual potentials u, v: a child's matrix is its parent's with some entries set to inf and then reduced, so the
+# parent's potentials (shifted by those reductions) stay feasible and the parent's assignment stays optimal
+# except for the one or two rows the new edge knocks out.  Only those get re-augmented, O(n**2) each
+class AssignmentBound():
+  def __init__(self):
+    self.row_to_col = None
+    self.col_to_row = None
+    self.u = None
+    self.v = None
+    self.row_open = None # cities the tour hasn't left yet
+    self.col_open = None # cities the tour hasn't entered yet
+    self.value = 0
+
+  # solve from scratch for a root matrix (already reduced, so zero potentials are feasible)
+  def fromMatrix(self, matrix):
+    n = len(matrix)
+    self.row_to_col = np.full(n, -1)
+    self.col_to_row = np.full(n, -1)
+    self.u = np.zeros(n)
+    self.v = np.zeros(n)
+    self.row_open = np.ones(n, dtype=bool)
+    self.col_open = np.ones(n, dtype=bool)
+    self.solve(matrix, range(n))
+    return self
+
+  # update the parent's solution for a child that took the edge src_index -> dest_index
+  # matrix is the child's reduced matrix and row_reduction, col_reduction what its reduce() took off
+  def fromParent(self, parent, matrix, row_reduction, col_reduction, src_index, dest_index):
+    self.row_to_col = parent.row_to_col.copy()
+    self.col_to_row = parent.col_to_row.copy()
+    self.u = parent.u - row_reduction
+    self.v = parent.v - col_reduction
+    self.row_open = parent.row_open.copy()
+    self.col_open = parent.col_open.copy()
+    self.row_open[src_index] = False
+    self.col_open[dest_index] = False
+
+    # drop every assigned pair that isn't available any more
+    rows = np.flatnonzero(self.row_to_col >= 0)
+    cols = self.row_to_col[rows]
+    lost = ~self.row_open[rows] | ~self.col_open[cols] | (matrix[rows, cols] == np.inf)
+    self.row_to_col[rows[lost]] = -1
+    self.col_to_row[cols[lost]] = -1
+
+    self.solve(matrix, np.flatnonzero(self.row_open & (self.row_to_col < 0)))
+    return self
+
+  # augment each of the given free rows, then total up the assignment
+  def solve(self, matrix, free_rows):
+    for row in free_rows:
+      if not self.augment(matrix, row):
+        self.value = np.inf
+        return
+
+    rows = np.flatnonzero(self.row_open)
+    self.value = np.add.reduce(matrix[rows, self.row_to_col[rows]])
+
+  # one shortest augmenting path (Dijkstra on the reduced costs) from free row start_row to a free open column
+  # returns False if there is none, i.e. no complete assignment exists
+  def augment(self, matrix, start_row):
+    n = len(matrix)
+    dist = matrix[start_row] - self.u[start_row] - self.v
+    dist[~self.col_open] = np.inf
+    pred = np.full(n, start_row)
+    scanned = np.zeros(n, dtype=bool)
+
+    while True:
+      unscanned = np.where(scanned, np.inf, dist)
+      col = np.argmin(unscanned)
+      delta = unscanned[col]
+      if delta == np.inf:
+        return False
+      scanned[col] = True
+
+      row = self.col_to_row[col]
+      if row < 0:
+        break
+
+      reduced = delta + matrix[row] - self.u[row] - self.v
+      better = (reduced < dist) & ~scanned & self.col_open
+      dist[better] = reduced[better]
+      pred[better] = row
+
+    # shift the potentials so the scanned part (and the path) is tight
+    shift = delta - dist[scanned]
+    scanned_cols = np.flatnonzero(scanned)
+    self.v[scanned_cols] -= shift
+    matched = self.col_to_row[scanned_cols]
+    self.u[matched[matched >= 0]] += shift[matched >= 0]
+    self.u[start_row] += delta
+
+    # flip the path
+    while True:
+      row = pred[col]
+      self.col_to_row[col] = row
+      col, self.row_to_col[row] = self.row_to_col[row], col
+      if row == start_row:
+        break
+
+    return True
+
+# max-heap on node.score(), ties go to the node that was inserted first
+# nodes are pruned lazily: prune() only marks entries dead (finding them through a second heap ordered on
+# lower_bound, so it touches just the nodes it prunes) and pop() throws dead entries away as it reaches them
 class PQ():
   def __init__(self):
-    self.list = []
+    self.heap = [] # [-score, insertion order, node or None once popped/pruned]
+    self.bound_heap = [] # (-lower_bound, insertion order, heap entry)
+    self.size = 0
     self.max_size = 0
+    self.counter = itertools.count()
 
   # insert a node into the pq
-  # O(1) time
+  # O(log n) time
   def insert(self, node):
-    self.list.append(node)
+    order = next(self.counter)
+    entry = [-node.score(), order, node]
+    heapq.heappush(self.heap, entry)
+    heapq.heappush(self.bound_heap, (-node.lower_bound, order, entry))
+    self.size += 1
 
     if len(self) > self.max_size:
       self.max_size = len(self)
 
-  # remove all nodes that have a higher minimum possible cost than new_bssf.cost
+  # remove all nodes that have a higher minimum possible cost than new_bssf_cost
   # returns the number of nodes pruned
-  # O(n) time
-  def prune(self, new_bssf):
+  # O(k log n) time for k pruned nodes
+  def prune(self, new_bssf_cost):
     n_pruned = 0
 
-    for n in self.list:
-      if n.lower_bound >= new_bssf.cost:
-        self.list.remove(n)
+    while len(self.bound_heap) > 0 and -self.bound_heap[0][0] >= new_bssf_cost:
+      entry = heapq.heappop(self.bound_heap)[2]
+      if entry[2] != None:
+        entry[2] = None
+        self.size -= 1
         n_pruned += 1
 
     return n_pruned
 
-  # remove the node with the highest score from the priority queue and return in
-  # O(n) time
-  def pop(self):
-    if len(self.list) == 0:
-      return None
+  # drop up to count nodes with the highest lower bounds, used when the search runs out of memory
+  # returns the number of nodes dropped
+  # O(k log n) time
+  def discardWorst(self, count):
+    n_discarded = 0
+
+    while n_discarded < count and len(self.bound_heap) > 0:
+      entry = heapq.heappop(self.bound_heap)[2]
+      if entry[2] != None:
+        entry[2] = None
+        self.size -= 1
+        n_discarded += 1
 
-    best = self.list[0]
+    return n_discarded
 
-    for n in self.list:
-      if n.score() > best.score():
-        best = n
+  # take up to count of the shallowest nodes (lowest score) out of the queue, to hand to another worker
+  # O(n) time, only used when a worker runs dry
+  def takeShallowest(self, count):
+    live = [entry for entry in self.heap if entry[2] != None]
+    taken = []
 
-    self.list.remove(best)
+    for entry in heapq.nlargest(count, live):
+      taken.append(entry[2])
+      entry[2] = None
+      self.size -= 1
 
-    return best
+    return taken
+
+  # remove the node with the highest score from the priority queue and return in
+  # O(log n) amortized time
+  def pop(self):
+    while len(self.heap) > 0:
+      entry = heapq.heappop(self.heap)
+      node = entry[2]
+      if node != None:
+        entry[2] = None
+        self.size -= 1
+        self.compact()
+        return node
+
+    return None
+
+  # every queued node, in the order they were inserted
+  # O(n log n) time
+  def nodes(self):
+    return [entry[2] for entry in sorted(self.heap, key=lambda entry: entry[1]) if entry[2] != None]
+
+  # popped nodes stay in bound_heap until a prune reaches them, rebuild it once they make up most of it
+  def compact(self):
+    if len(self.bound_heap) > 2 * self.size + 1024:
+      self.bound_heap = [item for item in self.bound_heap if item[2][2] != None]
+      heapq.heapify(self.bound_heap)
 
   def __len__(self):
-    return len(self.list)
+    return self.size
@@ -1,208 +1,665 @@
-from TSPClasses import TSPSolution
+from Instrumentation import SearchStats
+from ParallelSearch import gatherResults, joinProcesses, newShared, processStats, publishBest, sharedBest
+from TSPClasses import DistanceCache, TSPSolution
 
+import collections
+import math
+import multiprocessing
 import numpy as np
-import random
+import queue
 import time
 
 class GeneticSolver():
-  def __init__(self, cities, timeout=4, n_initial_solutions=100, population_size=100):
+  TOPOLOGIES = ('ring', 'complete', 'random')
+  # generations between migrations in the island model
+  MIGRATION_INTERVAL = 50
+  # move evaluations the local search may spend on each child
+  LOCAL_SEARCH_MOVES = 1000
+  # candidate list length the local search takes its moves from
+  LOCAL_SEARCH_NEIGHBORS = 5
+  # tours whose cost the fitness cache remembers
+  FITNESS_CACHE_SIZE = 10000
+
+  def __init__(self, cities, timeout=4, n_initial_solutions=100, population_size=100, distances=None, stats=None,
+               on_improvement=None, mutate_chance=0.1, seed=None, crossover='order', n_islands=1,
+               topology='ring', migration_interval=MIGRATION_INTERVAL, n_migrants=2, local_search=False,
+               local_search_moves=LOCAL_SEARCH_MOVES, deduplicate=True, fitness_cache_size=FITNESS_CACHE_SIZE):
     # set self variables for cities, timeout, and max_generations
     # create initial population of Solutions
+    # distances is the scenario's DistanceCache, looked up from the cities if not given
+    # stats is an optional Instrumentation.SearchStats to record the run in
+    # on_improvement is called with each new best TSPSolution as it's found, returning True stops the run early
+    # seed fixes the random numbers the run uses
+    # crossover picks how children are made from their parents, one of CROSSOVERS (see below)
+    # n_islands > 1 runs the island model, see solveIslands: that many populations of population_size evolve in
+    # their own processes, every migration_interval generations each one sends copies of its n_migrants best
+    # tours to the islands topology connects it to ('ring': the next one, 'complete': all of them, 'random': one
+    # picked at random each time)
+    # local_search polishes every child with 2-opt and Or-opt moves before it's scored (a memetic algorithm), see
+    # improveTour; each child gets at most local_search_moves move evaluations
+    # deduplicate turns away children that are the same tour (from any starting city) as one already in the
+    # population or an earlier child of the same generation, so a converging population keeps its diversity; tours
+    # are told apart by fingerprint (see tourFingerprints), and the costs of the last fitness_cache_size tours
+    # scored are kept by fingerprint so one bred again isn't scored again
+    #
+    # the population is one array: row i of self.population is individual i's tour (a permutation of city
+    # indices) and self.fitness[i] its cost, so scoring, tournaments and culling work on the whole population
+    # (or a whole generation's children) at once
+    if crossover not in CROSSOVERS:
+      raise Exception('Unsupported crossover: {}'.format(crossover))
+    if topology not in self.TOPOLOGIES:
+      raise Exception('Unsupported topology: {}'.format(topology))
+    self.crossover_name = crossover
+    self.crossover = CROSSOVERS[crossover]
+    self.n_islands = n_islands
+    self.topology = topology
+    self.migration_interval = migration_interval
+    self.n_migrants = n_migrants
+    self.local_search = local_search
+    self.local_search_moves = local_search_moves
+    self.deduplicate = deduplicate
+    self.fitness_cache_size = fitness_cache_size
+    self.fitness_cache = collections.OrderedDict() # fingerprint -> cost, least recently used first
+    self.seed = seed
+    self.on_improvement = on_improvement
+    self.stopped = False
     self.cities = cities
+    self.stats = stats if stats != None else SearchStats(enabled=False)
+    if distances == None:
+      distances = DistanceCache.forScenario(cities[0]._scenario)
+    self.distances = distances
+    self.costs = distances.costs
+    if local_search:
+      self.out_neighbors, self.in_neighbors = [k.tolist() for k in distances.getNeighbors(self.LOCAL_SEARCH_NEIGHBORS)]
     self.timeout = timeout
     self.n_initial_solutions = n_initial_solutions
-    self.solutions = []
     self.population_size = population_size
-    self.best = None
+    self.mutate_chance = mutate_chance
+    self.rng = np.random.default_rng(seed)
+    self.best = None # the best tour so far as a TSPSolution
+    self.generation = 0
 
-    for i in range(n_initial_solutions):
-      self.solutions.append(Solution().randomSolution(cities))
+    # the islands make their own populations
+    if n_islands > 1:
+      return
+
+    with self.stats.phase('initial population'):
+      self.population = np.argsort(self.rng.random((n_initial_solutions, len(cities))), axis=1)
+      self.fingerprints = tourFingerprints(self.population)
+      self.fitness = self.getFitness(self.population)
+      self.cacheFitness(self.fingerprints, self.fitness)
+    self.updateBest(self.population, self.fitness)
 
   def solve(self):
     # repeat iterGeneration until timeout or max_generations is reached
     # return the best scored solution
+    if self.n_islands > 1:
+      return self.solveIslands()
+
     results = {}
 
     self.start_time = time.time()
     self.generation = 0
-    timer = time.time()
-    while time.time() - self.start_time < self.timeout:
+    while not self.stopped and time.time() - self.start_time < self.timeout:
       self.generation += 1
 
-      if time.time() - timer > 10:
-        print("GENERATION", self.generation)
-        timer = time.time()
-
       self.iterGeneration()
-      self.cull()
+      with self.stats.phase('cull'):
+        self.cull()
+      self.checkIn()
     end_time = time.time()
+    self.stats.count('generations', self.generation)
 
-    results['cost'] = self.best.solution.cost
+    results['cost'] = self.best.cost
     results['time'] = end_time - self.start_time
     results['count'] = self.generation
-    results['soln'] = self.best.solution
+    results['soln'] = self.best
     results['max'] = None
     results['total'] = None
     results['pruned'] = None
+    results['stats'] = self.stats.toDict()
+
+    return results
+
+  # called after every generation, for runs that need to look outside themselves now and then
+  def checkIn(self):
+    pass
+
+  # the island model: n_islands GeneticSolvers, each in its own process with its own random numbers
+  # islands exchange migrants through a queue per island, and publish each new best tour through shared memory
+  # so this process can pass it on to on_improvement (and tell them all to stop if that returns True)
+  # each island returns its best tour and counters at the timeout, the best of them is the result and count is
+  # the total number of generations
+  def solveIslands(self):
+    start_time = time.time()
+    deadline = start_time + self.timeout
+
+    shared = newShared(len(self.cities), inboxes=[multiprocessing.Queue() for _ in range(self.n_islands)])
+
+    settings = {'n_initial_solutions': self.n_initial_solutions, 'population_size': self.population_size,
+                'mutate_chance': self.mutate_chance, 'crossover': self.crossover_name, 'topology': self.topology,
+                'migration_interval': self.migration_interval, 'n_migrants': self.n_migrants,
+                'local_search': self.local_search, 'local_search_moves': self.local_search_moves,
+                'deduplicate': self.deduplicate, 'fitness_cache_size': self.fitness_cache_size,
+                'stats': processStats(self.stats)}
+    seeds = np.random.SeedSequence(self.seed).spawn(self.n_islands)
+    islands = []
+    for index in range(self.n_islands):
+      island = multiprocessing.Process(target=runIsland, daemon=True,
+                                       args=(self.distances.getScenario(), index, deadline, settings, seeds[index],
+                                             shared))
+      island.start()
+      islands.append(island)
+
+    # gather every island's result, passing better tours on to on_improvement while waiting
+    self.generation = 0
+    def addIsland(result):
+      self.generation += result['count']
+      self.stats.merge(result['stats'])
+      if self.best == None or result['cost'] < self.best.cost:
+        self.best = TSPSolution.fromPermutation(self.distances.getScenario(), result['tour'])
+    gatherResults(shared, islands, deadline, addIsland, lambda: self.collectShared(shared),
+                  poll=self.on_improvement != None)
+    joinProcesses(islands)
+
+    end_time = time.time()
+    self.stats.setCount('generations', self.generation)
 
-    print(results)
+    results = {}
+    results['cost'] = self.best.cost if self.best != None else math.inf
+    results['time'] = end_time - start_time
+    results['count'] = self.generation
+    results['soln'] = self.best
+    results['max'] = None
+    results['total'] = None
+    results['pruned'] = None
+    results['stats'] = self.stats.toDict()
 
     return results
 
+  # take the islands' best tour if it's better, and tell the islands to stop if on_improvement says so
+  def collectShared(self, shared):
+    solution = sharedBest(shared, self.distances.getScenario(), self.best.cost if self.best != None else math.inf)
+    if solution != None:
+      self.best = solution
+      if self.on_improvement != None and self.on_improvement(self.best):
+        shared['stop'].value = 1
+
   def iterGeneration(self, breeding_percentage=0.5):
     # take all current solutions
     # pair them up
     # cross them over with their partners
     # get their fitness, rank them accordingly
     # call cull to limit population size
-    sol_len = len(self.solutions) - 1
-
-    for i in range(int(sol_len*breeding_percentage)):
-
-      r1 = random.randint(0, sol_len)
-      r2 = random.randint(0, sol_len)
-      r3 = random.randint(0, sol_len)
-      r4 = random.randint(0, sol_len)
-      while r1 in (r2, r3, r4) or r2 in (r1, r3, r4) or r3 in (r2, r1, r4) or r4 in (r2, r3, r1):
-        r1 = random.randint(0, sol_len)
-        r2 = random.randint(0, sol_len)
-        r3 = random.randint(0, sol_len)
-        r4 = random.randint(0, sol_len)
-
-      # r1 VS r2
-      mom = self.fight(r1, r2)
-      # r3 VS r4
-      dad = self.fight(r3, r4)
-
-      child = Solution().fromParents(mom, dad)
-
-      if self.best == None or self.best.solution.cost > child.solution.cost:
-        self.best = child
-        print("Found New Best Solution at t =", time.time() - self.start_time, "generation", self.generation)
-
-      self.solutions.append(child)
-
+    n_children = int((len(self.population) - 1) * breeding_percentage)
+    if n_children == 0:
+      return
+
+    with self.stats.phase('selection'):
+      # four different individuals per child, r1 VS r2 for the mom and r3 VS r4 for the dad
+      contestants = self.distinctRows(n_children, 4)
+      moms = self.fight(contestants[:, 0], contestants[:, 1])
+      dads = self.fight(contestants[:, 2], contestants[:, 3])
+
+    with self.stats.phase('crossover'):
+      children = self.crossover(self.population[moms], self.population[dads], self.rng)
+
+    with self.stats.phase('mutation'):
+      self.mutate(children)
+    self.stats.count('children', n_children)
+
+    with self.stats.phase('fingerprints'):
+      fingerprints = tourFingerprints(children)
+      if self.deduplicate:
+        keep = self.unseen(fingerprints)
+        children, fingerprints = children[keep], fingerprints[keep]
+        moms, dads = moms[keep], dads[keep]
+
+    if self.local_search:
+      with self.stats.phase('local search'):
+        self.improveChildren(children, self.population[moms], self.population[dads])
+      # improving a child can turn it into a tour that's already around
+      with self.stats.phase('fingerprints'):
+        fingerprints = tourFingerprints(children)
+        if self.deduplicate:
+          keep = self.unseen(fingerprints)
+          children, fingerprints = children[keep], fingerprints[keep]
+
+    if len(children) == 0:
+      return
+
+    with self.stats.phase('fitness'):
+      fitness = self.cachedFitness(children, fingerprints)
+
+    self.updateBest(children, fitness)
+
+    self.population = np.concatenate((self.population, children))
+    self.fingerprints = np.concatenate((self.fingerprints, fingerprints))
+    self.fitness = np.concatenate((self.fitness, fitness))
+
+  # which of a batch of fingerprints are neither in the population nor earlier in the batch
+  def unseen(self, fingerprints):
+    # the first occurrence of each fingerprint, with the population's coming first
+    firsts = np.unique(np.concatenate((self.fingerprints, fingerprints)), return_index=True)[1]
+    keep = np.zeros(len(fingerprints), dtype=bool)
+    keep[firsts[firsts >= len(self.fingerprints)] - len(self.fingerprints)] = True
+    self.stats.count('duplicates', len(keep) - int(np.count_nonzero(keep)))
+    return keep
+
+  # getFitness, except tours the fitness cache already has a cost for aren't scored again
+  def cachedFitness(self, tours, fingerprints):
+    fitness = np.empty(len(tours))
+    misses = []
+    for i, fingerprint in enumerate(fingerprints.tolist()):
+      cost = self.fitness_cache.get(fingerprint)
+      if cost == None:
+        misses.append(i)
+      else:
+        self.fitness_cache.move_to_end(fingerprint)
+        fitness[i] = cost
+    self.stats.count('fitness cache hits', len(tours) - len(misses))
+
+    if len(misses) > 0:
+      fitness[misses] = self.getFitness(tours[misses])
+      self.cacheFitness(fingerprints[misses], fitness[misses])
+    return fitness
+
+  # remember the costs of these tours, forgetting the least recently used ones past fitness_cache_size
+  def cacheFitness(self, fingerprints, fitness):
+    cache = self.fitness_cache
+    for fingerprint, cost in zip(fingerprints.tolist(), fitness.tolist()):
+      cache[fingerprint] = cost
+      cache.move_to_end(fingerprint)
+    while len(cache) > self.fitness_cache_size:
+      cache.popitem(last=False)
+
+  # n rows of k different population indices each
+  def distinctRows(self, n, k):
+    rows = self.rng.integers(0, len(self.population), size=(n, k))
+    while True:
+      ordered = np.sort(rows, axis=1)
+      clash = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+      if not clash.any():
+        return rows
+      rows[clash] = self.rng.integers(0, len(self.population), size=(np.count_nonzero(clash), k))
+
+  # the winners of the tournaments i1[t] VS i2[t]: the fitter of the two with probability chance, otherwise the
+  # other one (or the other way around with invert)
   def fight(self, i1, i2, chance=0.7, invert=False):
-    s1 = self.solutions[i1]
-    s2 = self.solutions[i2]
-
-    r = random.random()
-
-    if s1.solution.cost > s2.solution.cost:
-      best = s2
-      worst = s1
-    else:
-      best = s1
-      worst = s2
-
-
-    return_best = (r < chance)
+    first_is_best = self.fitness[i1] <= self.fitness[i2]
+    return_best = self.rng.random(len(i1)) < chance
 
     if invert:
-      return_best = not return_best
+      return_best = ~return_best
 
-    if return_best:
-      return best
-    else:
-      return worst
+    return np.where(first_is_best == return_best, i1, i2)
 
   def cull(self):
     # keep the best solution(s) from our population
     # randomly eliminate some of the other solutions
     # we may want to have some kind of weighted algorithm
     # for deciding which solutions to keep
-
-    while len(self.solutions) > self.population_size:
-      sol_len = len(self.solutions) - 1
-
-      r1 = random.randint(0, sol_len)
-      r2 = random.randint(0, sol_len)
-      while r1 == r2 or self.solutions[r1] == self.best or self.solutions[r2] == self.best:
-        r1 = random.randint(0, sol_len)
-        r2 = random.randint(0, sol_len)
+    #
+    # each round pairs up distinct individuals (never the best) and removes the loser of an inverted fight from
+    # each pair, as many pairs as it takes to get back down to population_size
+    while len(self.population) > self.population_size:
+      best = np.argmin(self.fitness)
+      others = self.rng.permutation(np.delete(np.arange(len(self.population)), best))
+      n_pairs = min(len(self.population) - self.population_size, len(others) // 2)
+      if n_pairs == 0:
+        break
 
       # r1 VS r2
-      loser = self.fight(r1, r2, invert=True)
-
-      self.solutions.remove(loser)
-
-
-class Solution():
-  def __init__(self, mutate_chance=0.1):
-    self.sequence = []
-    self.solution = None
-    self.mutate_chance = mutate_chance
-
-  def randomSolution(self, cities):
-    # generates a random sequence from cities that
-    # contains each city exactly once
-    # gets fitness
-    perm = np.random.permutation(len(cities))
-    for i in perm:
-      self.sequence.append(cities[i])
-
-    self.getFitness()
-
-    return self
-
-  def fromParents(self, p1, p2):
-    # our crossover function
-    # constructs a solution from two parent solutions
-    # constructs a sequence by crossing over the parent sequences
-    # has a random chance of calling mutate
-    # gets fitness for self
-
-    seq_len = len(p1.sequence)
-
-    start = random.randint(0, seq_len-1)
-    end = random.randint(0, seq_len-1)
-
-    if start > end:
-      start, end = end, start
-
-    self.sequence = [None]*seq_len
-
-    for i in range(start, end):
-      self.sequence[i] = p1.sequence[i]
-
-    for c in p2.sequence:
-      if c not in self.sequence:
-        index = self.sequence.index(None)
-        self.sequence[index] = c
-
-    self.getFitness()
-
-    if random.random() < self.mutate_chance:
-      self.mutate()
-
-    return self
-
-  def mutate(self):
-    # will randomly swap two cities in the solutions sequence
-    i = random.randint(0, len(self.sequence)-1)
-    j = random.randint(0, len(self.sequence)-1)
-
-    while j == i:
-      j = random.randint(0, len(self.sequence)-1)
-
-    # SUSPECT
-    self.sequence[i], self.sequence[j] = self.sequence[j], self.sequence[i]
-
-    self.getFitness()
-
-  def getFitness(self):
-    # gets the distance of self's sequence
-    # can be done with the TSPSolution class
-    self.solution = TSPSolution(self.sequence)
-
-  def __str__(self):
-    output = "[ "
-
-    for city in self.sequence:
-      output += city._name + " "
-
-    output += "]"
-
-    output += " cost: " + str(self.solution.cost)
-
-    return output
+      losers = self.fight(others[:n_pairs], others[n_pairs:2 * n_pairs], invert=True)
+
+      keep = np.ones(len(self.population), dtype=bool)
+      keep[losers] = False
+      self.population = self.population[keep]
+      self.fingerprints = self.fingerprints[keep]
+      self.fitness = self.fitness[keep]
+
+  # swap two random cities in each child with probability mutate_chance, in place
+  def mutate(self, children):
+    mutants = np.flatnonzero(self.rng.random(len(children)) < self.mutate_chance)
+    ncities = children.shape[1]
+    if len(mutants) == 0 or ncities < 2:
+      return
+
+    i = self.rng.integers(0, ncities, size=len(mutants))
+    j = (i + self.rng.integers(1, ncities, size=len(mutants))) % ncities # never the same as i
+    children[mutants, i], children[mutants, j] = children[mutants, j], children[mutants, i]
+
+  # the memetic stage: run improveTour on each child, in place
+  # the don't-look bits start off only for the cities at the ends of edges the child got from neither parent
+  # (crossover joins and mutations), the rest of the child is as good as its parents left it
+  def improveChildren(self, children, moms, dads):
+    scenario = self.distances.getScenario()
+    deadline = self.start_time + self.timeout
+    new_edges = ~(sharedEdges(children, moms) | sharedEdges(children, dads))
+    new_edges |= np.roll(new_edges, 1, axis=1)
+    evaluations = 0
+    for c in range(len(children)):
+      if time.time() >= deadline:
+        break
+      solution = TSPSolution.fromPermutation(scenario, children[c])
+      solution, used = improveTour(solution, children[c][new_edges[c]].tolist(), self.out_neighbors,
+                                   self.in_neighbors, self.local_search_moves)
+      children[c] = solution.perm
+      evaluations += used
+    self.stats.count('local search moves', evaluations)
+
+  # the cost of every tour in tours at once: gather each leg off the cost matrix and sum along the rows
+  def getFitness(self, tours):
+    return self.costs[tours, np.roll(tours, -1, axis=1)].sum(axis=1)
+
+  # check a batch of new tours for a new best
+  def updateBest(self, tours, fitness):
+    i = np.argmin(fitness)
+    if self.best == None or fitness[i] < self.best.cost:
+      self.best = TSPSolution.fromPermutation(self.distances.getScenario(), tours[i])
+      self.stats.improvement(self.best.cost, generation=self.generation)
+      if self.on_improvement != None and self.best.cost < np.inf and self.on_improvement(self.best):
+        self.stopped = True
+
+# one population of the island model, see GeneticSolver.solveIslands
+class Island(GeneticSolver):
+  def __init__(self, cities, index, island_count, shared, **settings):
+    self.index = index
+    self.island_count = island_count
+    self.shared = shared
+    super().__init__(cities, **settings)
+
+  # publish each new best tour that beats every other island's
+  def updateBest(self, tours, fitness):
+    best = self.best
+    super().updateBest(tours, fitness)
+
+    if self.best is not best:
+      publishBest(self.shared, self.best)
+
+  def checkIn(self):
+    if self.shared['stop'].value:
+      self.stopped = True
+    if self.generation % self.migration_interval == 0:
+      with self.stats.phase('migration'):
+        self.migrate()
+
+  # the islands this one sends its migrants to
+  def migrationTargets(self):
+    others = [i for i in range(self.island_count) if i != self.index]
+    if self.topology == 'ring':
+      return [(self.index + 1) % self.island_count]
+    elif self.topology == 'complete':
+      return others
+    else:
+      return [others[self.rng.integers(0, len(others))]]
+
+  # send copies of the best few tours out, and let whatever has arrived replace the worst few here
+  def migrate(self):
+    inboxes = self.shared['inboxes']
+    migrants = self.population[np.argsort(self.fitness)[:self.n_migrants]]
+    for target in self.migrationTargets():
+      inboxes[target].put(migrants)
+
+    arrivals = []
+    while True:
+      try:
+        arrivals.append(inboxes[self.index].get_nowait())
+      except queue.Empty:
+        break
+    if len(arrivals) == 0:
+      return
+
+    arrivals = np.concatenate(arrivals)
+    fingerprints = tourFingerprints(arrivals)
+    if self.deduplicate:
+      # a converged neighbour keeps sending tours this island already has
+      keep = self.unseen(fingerprints)
+      arrivals, fingerprints = arrivals[keep], fingerprints[keep]
+    arrivals, fingerprints = arrivals[:len(self.population) - 1], fingerprints[:len(self.population) - 1]
+    if len(arrivals) == 0:
+      return
+
+    worst = np.argsort(self.fitness)[len(self.population) - len(arrivals):]
+    self.population[worst] = arrivals
+    self.fingerprints[worst] = fingerprints
+    self.fitness[worst] = self.cachedFitness(arrivals, fingerprints)
+    self.updateBest(arrivals, self.fitness[worst])
+    self.stats.count('migrants', len(arrivals))
+
+  def run(self, deadline):
+    for inbox in self.shared['inboxes']:
+      inbox.cancel_join_thread()
+    self.timeout = max(0.0, deadline - time.time())
+    results = self.solve()
+    self.shared['results'].put({'tour': [int(i) for i in results['soln'].perm], 'cost': results['cost'],
+                                'count': results['count'], 'stats': results['stats']})
+
+def runIsland(scenario, index, deadline, settings, seed, shared):
+  island = Island(scenario.getCities(), index, len(shared['inboxes']), shared, seed=seed, **settings)
+  island.run(deadline)
+
+# a 64 bit fingerprint for each row of tours that's the same for any rotation of the tour: the sum of its cities
+# times random weights (wrapping around 2**64), where the weights are counted from wherever city 0 is, so equal
+# tours get equal fingerprints wherever they were cut, and two different ones only share one by a 1 in 2**64 sort
+# of fluke.  A tour and its reverse are different tours, with asymmetric costs
+def tourFingerprints(tours):
+  global FINGERPRINT_WEIGHTS
+  ncities = tours.shape[1]
+  if len(FINGERPRINT_WEIGHTS) != 2 * ncities:
+    weights = np.random.default_rng(0).integers(0, 2**64, size=ncities, dtype=np.uint64)
+    FINGERPRINT_WEIGHTS = np.concatenate((weights, weights))
+  # position i of a row gets weight (i - position of city 0) mod ncities
+  starts = np.argmax(tours == 0, axis=1)[:, np.newaxis]
+  weights = FINGERPRINT_WEIGHTS[ncities - starts + np.arange(ncities)]
+  return (tours.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+
+# the weights tourFingerprints uses, twice over, for the last number of cities it was asked about
+FINGERPRINT_WEIGHTS = np.zeros(0, dtype=np.uint64)
+
+# which legs of each tour are also legs of the matching row of others: shared[r, i] is True if the leg from
+# position i of tours[r] to the next one is in others[r] (in the same direction)
+def sharedEdges(tours, others):
+  successors = np.empty_like(others)
+  np.put_along_axis(successors, others, np.roll(others, -1, axis=1), axis=1)
+  return np.take_along_axis(successors, tours, axis=1) == np.roll(tours, -1, axis=1)
+
+# smallest cost change the local search counts as an improvement, so rounding in the deltas can't loop forever
+IMPROVEMENT_EPSILON = 1e-9
+
+# local search on one tour (a TSPSolution): a city is looked at by trying the moves that give it a leg to or from
+# one of its candidate neighbors, and the best improving one is made
+#   2-opt: reverse the stretch between the city and a neighbor b so the city goes straight to b (or comes
+#   straight from a neighbor c); with asymmetric costs the reversed stretch's legs all change, which the
+#   solution's prefix sums price in O(1)
+#   Or-opt: move the city and the one or two after it to follow a neighbor c
+# don't-look bits: only the cities in the queue get looked at, starting with the given cities; one that has
+# nothing to improve drops out until a move changes one of its legs.  The tour is rotated to put the city being
+# looked at first, so none of these moves wraps around the end of perm
+# stops when the queue runs out or after max_evaluations move evaluations, returns the improved solution and the
+# evaluations used
+def improveTour(solution, cities, out_neighbors, in_neighbors, max_evaluations, max_segment=3):
+  scenario = solution._scenario
+  ncities = len(solution.perm)
+  if ncities < 5:
+    return solution, 0
+
+  active = collections.deque(cities)
+  queued = np.zeros(ncities, dtype=bool)
+  queued[cities] = True
+  positions = np.empty(ncities, dtype=np.intp)
+  evaluations = 0
+  while len(active) > 0 and evaluations < max_evaluations:
+    a = active.popleft()
+    queued[a] = False
+    perm = solution.perm
+    start = int(np.flatnonzero(perm == a)[0])
+    if start != 0:
+      solution = TSPSolution.fromPermutation(scenario, np.roll(perm, -start))
+      perm = solution.perm
+    positions[perm] = np.arange(ncities)
+
+    best_delta = -IMPROVEMENT_EPSILON
+    best_move = None
+    for b in out_neighbors[a]:
+      if b < 0:
+        break
+      j = positions[b]
+      if j > 1:
+        # a -> b, perm[1..j] reversed
+        delta = solution.reverseDelta(1, j)
+        evaluations += 1
+        if delta < best_delta:
+          best_delta, best_move = delta, ('reverse', 1, j)
+    for c in in_neighbors[a]:
+      if c < 0:
+        break
+      k = positions[c]
+      if k < ncities - 1:
+        # c -> a, perm[k..] reversed
+        delta = solution.reverseDelta(k, ncities - 1)
+        evaluations += 1
+        if delta < best_delta:
+          best_delta, best_move = delta, ('reverse', k, ncities - 1)
+      for length in range(1, max_segment + 1):
+        if length <= k <= ncities - 2:
+          # c -> a, perm[0..length-1] moved after c
+          delta = solution.insertDelta(0, length - 1, k)
+          evaluations += 1
+          if delta < best_delta:
+            best_delta, best_move = delta, ('insert', length - 1, k)
+
+    if best_move == None:
+      continue
+
+    # every city whose legs change gets looked at again, a included
+    kind, i, j = best_move
+    if kind == 'reverse':
+      touched = perm[[i - 1, i, j, (j + 1) % ncities]].tolist()
+      solution.applyReverse(i, j)
+    else:
+      touched = perm[[ncities - 1, 0, i, i + 1, j, j + 1]].tolist()
+      solution.applyInsert(0, i, j)
+    for city in touched:
+      if not queued[city]:
+        queued[city] = True
+        active.append(city)
+
+  return solution, evaluations
+
+# the crossover functions: each makes one child from each pair of rows of moms and dads (2-D arrays of tours) and
+# returns them as a new array, all in O(n) per child
+
+# a random slice start:end for each of n children of ncities
+def cutPoints(rng, n, ncities):
+  cuts = np.sort(rng.integers(0, ncities + 1, size=(n, 2)), axis=1)
+  return cuts[:, :1], cuts[:, 1:]
+
+# where each city sits in each tour: positions[r, tours[r, i]] = i
+def tourPositions(tours):
+  positions = np.empty_like(tours)
+  np.put_along_axis(positions, tours, np.arange(tours.shape[1]), axis=1)
+  return positions
+
+# order crossover: a random slice of the mom stays where it is and the rest of the cities fill the other
+# positions in the order they come in the dad
+# every row has as many cities left to place as it has free positions, so one boolean-mask assignment fills them
+# all, row by row, in order
+def orderCrossover(moms, dads, rng):
+  start, end = cutPoints(rng, len(moms), moms.shape[1])
+  positions = np.arange(moms.shape[1])
+  kept = (start <= positions) & (positions < end)
+
+  # a city is already placed if it's inside the slice of the mom
+  placed = np.take_along_axis(kept, tourPositions(moms), axis=1)
+
+  children = np.where(kept, moms, 0)
+  children[~kept] = dads[~np.take_along_axis(placed, dads, axis=1)]
+  return children
+
+# partially mapped crossover: a random slice of the mom stays where it is and every other position takes the
+# dad's city there, unless that city is already in the slice; then the slice maps it mom -> dad (the dad's city
+# at the position the mom has it) until it lands on a city that isn't
+# positions stay where one parent had them, which suits asymmetric tours better than order crossover's shifting
+def partiallyMappedCrossover(moms, dads, rng):
+  start, end = cutPoints(rng, len(moms), moms.shape[1])
+  positions = np.arange(moms.shape[1])
+  kept = (start <= positions) & (positions < end)
+  mom_positions = tourPositions(moms)
+  placed = np.take_along_axis(kept, mom_positions, axis=1)
+  rows = np.arange(len(moms))[:, np.newaxis]
+
+  children = np.where(kept, moms, dads)
+  # each pass moves every clashing city one step along its mapping chain, and drops the ones that have landed,
+  # so a pass only touches the positions still clashing
+  r, i = np.nonzero(~kept & placed[rows, children])
+  while len(r) > 0:
+    children[r, i] = dads[r, mom_positions[r, children[r, i]]]
+    clashing = placed[r, children[r, i]]
+    r, i = r[clashing], i[clashing]
+  return children
+
+# directed edge recombination: builds the child city by city from the edges its parents use, so it keeps as many
+# of the parents' edges (in their direction) as it can
+# from each city it follows an edge to an unvisited successor of that city in either parent: the one both
+# parents agree on if there is one, otherwise the one with the fewest unvisited successors left of its own (so
+# cities aren't stranded), ties broken at random; with no such successor it jumps to a random unvisited city
+# all the children are built together, a city at a time, so each step is a handful of operations on arrays as
+# long as the batch; the per-city tables are flattened so that child r's entry for a city is at r * ncities + city
+def edgeRecombination(moms, dads, rng):
+  n_children, ncities = moms.shape
+  offsets = np.arange(n_children) * ncities
+  # each city's successor and predecessor in the mom and in the dad (as flat indices), and whether the dad's edge
+  # is a different one
+  mom_successors, dad_successors = np.empty_like(moms), np.empty_like(moms)
+  mom_predecessors, dad_predecessors = np.empty_like(moms), np.empty_like(moms)
+  for tours, successors, predecessors in ((moms, mom_successors, mom_predecessors),
+                                          (dads, dad_successors, dad_predecessors)):
+    np.put_along_axis(successors, tours, np.roll(tours, -1, axis=1), axis=1)
+    np.put_along_axis(predecessors, tours, np.roll(tours, 1, axis=1), axis=1)
+  two_successors = (dad_successors != mom_successors).ravel()
+  two_predecessors = (dad_predecessors != mom_predecessors).ravel().astype(np.intp)
+  mom_successors, dad_successors, mom_predecessors, dad_predecessors = [
+    (table + offsets[:, np.newaxis]).ravel() for table in (mom_successors, dad_successors, mom_predecessors,
+                                                           dad_predecessors)]
+  n_open = 1 + two_successors.astype(np.intp) # unvisited successors left per city
+
+  # an order to pick random unvisited cities from, moved through once per child
+  fallbacks = np.argsort(rng.random(moms.shape), axis=1)
+  next_fallback = np.zeros(n_children, dtype=np.intp)
+  coins = rng.random(moms.shape) >= 0.5
+
+  visited = np.zeros(moms.size, dtype=bool)
+  children = np.empty_like(moms)
+  children[:, 0] = moms[:, 0]
+  city = moms[:, 0] + offsets
+
+  for step in range(1, ncities):
+    visited[city] = True
+    n_open[mom_predecessors[city]] -= 1
+    n_open[dad_predecessors[city]] -= two_predecessors[city]
+
+    # (where the parents agree the dad's successor is the mom's, so either choice is the same city)
+    first, second = mom_successors[city], dad_successors[city]
+    first_open, second_open = ~visited[first], ~visited[second] & two_successors[city]
+    first_count, second_count = n_open[first], n_open[second]
+    take_second = second_open & (~first_open | (first_count > second_count) |
+                                 ((first_count == second_count) & coins[:, step]))
+    city = np.where(take_second, second, first)
+
+    stuck = np.flatnonzero(~first_open & ~second_open)
+    while len(stuck) > 0:
+      fallback = fallbacks[stuck, next_fallback[stuck]] + offsets[stuck]
+      taken = visited[fallback]
+      city[stuck[~taken]] = fallback[~taken]
+      stuck = stuck[taken]
+      next_fallback[stuck] += 1
+    children[:, step] = city - offsets
+
+  return children
+
+CROSSOVERS = {
+  'order': orderCrossover,
+  'pmx': partiallyMappedCrossover,
+  'edge': edgeRecombination,
+}
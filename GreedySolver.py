@@ -1,14 +1,29 @@
-import copy
 import numpy as np
 import time
 import math
 
-from TSPClasses import TSPSolution
+from Instrumentation import SearchStats
+from TSPClasses import DistanceCache, Scenario, TSPSolution
 
 class GreedySolver():
-  def __init__(self, cities, timeout):
+  # distances is the scenario's DistanceCache, looked up from the cities if not given
+  # stats is an optional Instrumentation.SearchStats to record the run in
+  # on_improvement is called with the tour once it's found (there's only ever the one)
+  def __init__(self, cities, timeout, n_neighbors=Scenario.DEFAULT_NEIGHBORS, distances=None, stats=None,
+               on_improvement=None):
     self.cities = cities
+    self.on_improvement = on_improvement
     self.timeout = timeout
+    self.stats = stats if stats != None else SearchStats(enabled=False)
+    if distances == None:
+      distances = DistanceCache.forScenario(cities[0]._scenario)
+    self.distances = distances
+    self.scenario = distances.getScenario()
+    self.costs = distances.costs
+    # each city's cheapest outgoing edges, checked before falling back to a full scan
+    with self.stats.phase('neighbor lists'):
+      self.neighbors = distances.getNeighbors(n_neighbors)[0]
+    self.visited = None
 
   # find a greedy solution to the list of cities given
   def solve(self, starting_index):
@@ -16,18 +31,21 @@ class GreedySolver():
 
     self.start_time = time.time()
 
+    self.visited = np.zeros(len(self.cities), dtype=bool)
+    self.visited[starting_index] = True
+
     # this is where the work is done
-    sequence = self.run_iteration([starting_index])
+    with self.stats.phase('search'):
+      sequence = self.run_iteration([starting_index])
 
     time_elapsed = time.time() - self.start_time
 
     # if a solution was found create a TSPSolution object
     if sequence != None:
-      city_list = []
-      for i in sequence:
-        city_list.append(self.cities[i])
-
-      solution = TSPSolution(city_list)
+      solution = TSPSolution.fromPermutation(self.scenario, sequence)
+      self.stats.improvement(solution.cost)
+      if self.on_improvement != None:
+        self.on_improvement(solution)
 
     # if no solution was found set the solution to None
     else:
@@ -40,15 +58,17 @@ class GreedySolver():
     results['max'] = None
     results['total'] = None
     results['pruned'] = None
+    results['stats'] = self.stats.toDict()
 
     return results
 
   # recusive function that greedily tries to cheepest edge leading to an untried city leaving from the current city
   # if that edge returns no solution try the next cheapest edge until all have been exhausted
+  # sequence and self.visited are shared down the recursion; whatever a call adds to them it takes back off
+  # before returning None
   def run_iteration(self, sequence):
     current_index = sequence[-1]
-    current_city = self.cities[current_index]
-    tried_cities = []
+    tried_cities = set()
 
     solution = None
 
@@ -56,37 +76,54 @@ class GreedySolver():
     while solution == None and len(tried_cities) + len(sequence) < len(self.cities) and time.time() - self.start_time < self.timeout:
 
       # find the city with the cheapest edge going to it that we haven't visited yet
-      best = None
-      for i in range(len(self.cities)):
-        if i not in sequence and i not in tried_cities:
-          if best == None and current_city.costTo(self.cities[i]) < np.inf:
-            best = i
-          elif best != None and current_city.costTo(self.cities[i]) < current_city.costTo(self.cities[best]):
-            best = i
-
-      # make a new sequence to pass to the next iteration of the function
+      best = self.cheapest_candidate(current_index, tried_cities)
+
       if best == None:
         return None
 
-      new_sequence = copy.deepcopy(sequence)
-      new_sequence.append(best)
+      sequence.append(best)
+      self.visited[best] = True
+      self.stats.count('extensions')
 
       # check if we've found a tour
       # check if our new sequence includes all the cities
-      if len(new_sequence) == len(self.cities):
+      if len(sequence) == len(self.cities):
         # check if the cost from the last city in the sequence to the first is not inf, that means we've found a tour
         # return the sequence if it is a tour but if it is inf return None
-        if self.cities[new_sequence[-1]].costTo(self.cities[new_sequence[0]]) != np.inf:
-          return new_sequence
+        if self.costs[sequence[-1], sequence[0]] != np.inf:
+          return list(sequence)
         else:
+          sequence.pop()
+          self.visited[best] = False
           return None
 
-      # if we haven't made a complete sequence yet run the function on the new sequence
-      solution = self.run_iteration(new_sequence)
+      # if we haven't made a complete sequence yet run the function on the extended sequence
+      solution = self.run_iteration(sequence)
 
       # if a solution wasn't returned for the best index found
       # add it to the tried list and rerun the loop
       if solution == None:
-        tried_cities.append(best)
+        sequence.pop()
+        self.visited[best] = False
+        tried_cities.add(best)
 
     return solution
+
+  # the unvisited, untried city with the cheapest finite edge from current_index, or None
+  # walks current_index's neighbor list first (O(k)) and only scans every city when none of those are left
+  def cheapest_candidate(self, current_index, tried_cities):
+    for i in self.neighbors[current_index]:
+      if i < 0:
+        break
+      if not self.visited[i] and i not in tried_cities:
+        return int(i)
+
+    current_costs = self.costs[current_index]
+    available = ~self.visited
+    available[list(tried_cities)] = False
+    best = np.argmin(np.where(available, current_costs, np.inf))
+
+    if not available[best] or current_costs[best] == np.inf:
+      return None
+
+    return int(best)
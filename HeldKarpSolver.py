@@ -0,0 +1,152 @@
+import numpy as np
+import math
+import time
+
+from Instrumentation import SearchStats
+from TSPClasses import DistanceCache, TSPSolution
+
+# exact solver: the Held-Karp dynamic program over subsets of cities
+# the tour starts at the given city; best[S, j] is the cheapest path that leaves the start, visits exactly the
+# other cities in the bitmask S and ends at j (a member of S).  Subsets are filled in layers of equal size, and
+# within a layer everything ending at the same city j is done with one vectorized min over the previous layer,
+# so the work is O(2**n * n**2) but the Python overhead is only O(n**2).  Missing edges are inf and stay inf
+# all the way through, so a scenario with no tour at all comes out with cost inf
+# it needs O(2**n * n) memory, which is known before anything runs: memoryNeeded() reports it and solve()
+# refuses (with a MemoryError) to start anything that won't fit in memory_limit
+class HeldKarpSolver():
+  DEFAULT_MEMORY_LIMIT = 2 * 1024**3
+
+  # distances is the scenario's DistanceCache, looked up from the cities if not given
+  # stats is an optional Instrumentation.SearchStats to record the run in
+  # on_improvement is called with the optimal tour once it's found
+  def __init__(self, cities, time_allowance=60.0, memory_limit=DEFAULT_MEMORY_LIMIT, distances=None, stats=None,
+               on_improvement=None):
+    self.cities = cities
+    self.on_improvement = on_improvement
+    self.stats = stats if stats != None else SearchStats(enabled=False)
+    self.time_allowance = time_allowance
+    self.memory_limit = memory_limit
+    if distances == None:
+      distances = DistanceCache.forScenario(cities[0]._scenario)
+    self.distances = distances
+    self.costs = distances.costs
+
+  # estimated peak bytes for a scenario of ncities
+  # per subset of the other cities: a float64 cost and an int8 predecessor for each end city, plus the subset
+  # sizes, their ordering used to split the subsets into layers and the sort's working space for that
+  # on top of that fill's temporaries, at their biggest in the middle layer: the layer's subsets and the bit tests
+  # on them, and for the subsets ending at one city the previous layer's costs gathered for them and the choices;
+  # the gather is counted twice, as the allocator doesn't hand each one back before the next is made
+  @staticmethod
+  def memoryNeeded(ncities):
+    m = max(0, ncities - 1)
+    nsubsets = 2**m
+    largest_layer = math.comb(m, m // 2)
+    largest_ending = math.comb(m - 1, (m - 1) // 2) if m > 0 else 0
+    return (nsubsets * m * (8 + 1) + nsubsets * (1 + 8 + 8) + largest_layer * 8 * 4
+            + largest_ending * (m * 8 * 2 + 8 * 4))
+
+  # find an optimal tour starting at start_index, or give up at the time allowance with cost inf
+  # O(2**n * n**2) time
+  # O(2**n * n) space
+  def solve(self, start_index):
+    ncities = len(self.cities)
+    memory_needed = self.memoryNeeded(ncities)
+    if memory_needed > self.memory_limit:
+      raise MemoryError('Held-Karp on {} cities needs about {} bytes, more than the limit of {}'.format(
+        ncities, memory_needed, self.memory_limit))
+
+    start_time = time.time()
+    deadline = start_time + self.time_allowance
+
+    # renumber so the start city is 0 and the rest are 1..m, city c + 1 is bit c of a subset
+    order = np.array([start_index] + [i for i in range(ncities) if i != start_index])
+    costs = self.costs[np.ix_(order, order)]
+    m = ncities - 1
+
+    route = None
+    if m == 0:
+      route = [0]
+    else:
+      with self.stats.phase('dynamic program'):
+        best, previous = self.fill(costs, m, deadline)
+      if best is not None:
+        with self.stats.phase('backtrack'):
+          route = self.backtrack(costs, best, previous, m)
+
+    solution = None
+    if route != None:
+      solution = TSPSolution.fromPermutation(self.distances.getScenario(), order[route])
+      if solution.cost == math.inf:
+        solution = None
+      else:
+        self.stats.improvement(solution.cost)
+        if self.on_improvement != None:
+          self.on_improvement(solution)
+
+    results = {}
+    results['cost'] = solution.cost if solution != None else math.inf
+    results['time'] = time.time() - start_time
+    results['count'] = 1 if solution != None else 0
+    results['soln'] = solution
+    results['max'] = None
+    results['total'] = 2**m * m # dynamic program states
+    results['pruned'] = None
+    results['memory'] = memory_needed
+    results['stats'] = self.stats.toDict()
+
+    return results
+
+  # fill in best and previous (the city before j on that path) for every subset, a layer at a time
+  # returns (None, None) if the deadline passes first
+  def fill(self, costs, m, deadline):
+    nsubsets = 2**m
+    best = np.full((nsubsets, m), np.inf)
+    previous = np.full((nsubsets, m), -1, dtype=np.int8)
+
+    # subset sizes, then the subsets grouped into layers by size
+    sizes = np.zeros(nsubsets, dtype=np.uint8)
+    for bit in range(m):
+      sizes[1 << bit:2 << bit] = sizes[:1 << bit] + 1
+    by_size = np.argsort(sizes, kind='stable')
+    layer_starts = np.searchsorted(sizes[by_size], np.arange(m + 2))
+
+    # paths of one leg straight out of the start
+    singles = 1 << np.arange(m)
+    best[singles, np.arange(m)] = costs[0, 1:]
+
+    for size in range(2, m + 1):
+      if time.time() >= deadline:
+        return None, None
+
+      layer = by_size[layer_starts[size]:layer_starts[size + 1]]
+      self.stats.count('states', len(layer) * size)
+      for j in range(m):
+        subsets = layer[(layer >> j) & 1 == 1]
+        # best[without j, i] is inf for any i not in the smaller subset, so the min only picks real paths
+        candidates = best[subsets ^ (1 << j)]
+        candidates += costs[1:, j + 1] # in place, one temporary the size of the gather is plenty
+        choice = np.argmin(candidates, axis=1)
+        best[subsets, j] = candidates[np.arange(len(subsets)), choice]
+        previous[subsets, j] = choice
+
+    return best, previous
+
+  # close the cheapest full path back to the start and walk the predecessors back to recover the route
+  # returns None if every way of closing it is inf
+  def backtrack(self, costs, best, previous, m):
+    full = 2**m - 1
+    closed = best[full] + costs[1:, 0]
+    j = int(np.argmin(closed))
+    if closed[j] == np.inf:
+      return None
+
+    route = []
+    subset = full
+    while j >= 0:
+      route.append(j + 1)
+      subset, j = subset ^ (1 << j), int(previous[subset, j])
+    route.append(0)
+    route.reverse()
+
+    return route
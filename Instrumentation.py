@@ -0,0 +1,86 @@
+import contextlib
+import json
+import time
+
+# opt-in instrumentation shared by the solvers
+# a solver given a SearchStats records where its time goes (named phases), how much work it did (counters, which
+# also come out as rates per second) and a time stamped trace of every improvement to its best solution.  The
+# solvers all take stats=None, which gets them a disabled SearchStats: every call on that is a no-op (phase()
+# hands back a shared do-nothing context manager) so the inner loops don't have to check for it
+class SearchStats():
+  _NO_PHASE = contextlib.nullcontext()
+
+  def __init__(self, enabled=True):
+    self.enabled = enabled
+    self.start_time = time.time()
+    self.phases = {} # name -> [seconds, calls]
+    self.counters = {}
+    self.improvements = [] # {'time': seconds since start_time, 'cost': ..., anything else the solver adds}
+
+  # time the body of a with block as part of phase name
+  def phase(self, name):
+    if not self.enabled:
+      return self._NO_PHASE
+    return self._timePhase(name)
+
+  @contextlib.contextmanager
+  def _timePhase(self, name):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.addTime(name, time.perf_counter() - start)
+
+  # add seconds timed some other way to phase name
+  def addTime(self, name, seconds, calls=1):
+    if self.enabled:
+      totals = self.phases.setdefault(name, [0.0, 0])
+      totals[0] += seconds
+      totals[1] += calls
+
+  def count(self, name, amount=1):
+    if self.enabled:
+      self.counters[name] = self.counters.get(name, 0) + amount
+
+  # for counters a solver keeps itself and just reports at the end
+  def setCount(self, name, value):
+    if self.enabled:
+      self.counters[name] = value
+
+  # a new best solution; details are extra JSON-able fields for the trace (e.g. generation or states so far)
+  def improvement(self, cost, **details):
+    if self.enabled:
+      entry = {'time': time.time() - self.start_time, 'cost': float(cost)}
+      entry.update(details)
+      self.improvements.append(entry)
+
+  # fold in the toDict() of a SearchStats that ran somewhere else (e.g. another process) over the same period
+  def merge(self, other):
+    if self.enabled and other != None:
+      for name, phase in other['phases'].items():
+        self.addTime(name, phase['time'], phase['calls'])
+      for name, amount in other['counters'].items():
+        self.count(name, amount)
+      self.improvements.extend(other['improvements'])
+      self.improvements.sort(key=lambda entry: entry['time'])
+
+  # everything recorded so far as plain dicts and lists, None when disabled
+  def toDict(self):
+    if not self.enabled:
+      return None
+
+    elapsed = time.time() - self.start_time
+    return {
+      'elapsed': elapsed,
+      'phases': {name: {'time': seconds, 'calls': calls} for name, (seconds, calls) in self.phases.items()},
+      'counters': dict(self.counters),
+      'rates': {name: amount / elapsed for name, amount in self.counters.items()} if elapsed > 0 else {},
+      'improvements': list(self.improvements),
+    }
+
+  def toJSON(self, **kwargs):
+    return json.dumps(self.toDict(), **kwargs)
+
+  def save(self, filename):
+    with open(filename, 'w') as f:
+      f.write(self.toJSON(indent=2))
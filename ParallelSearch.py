@@ -0,0 +1,89 @@
+import math
+import multiprocessing
+import queue
+import time
+
+from Instrumentation import SearchStats
+from TSPClasses import TSPSolution
+
+# what the solvers that spread a search over several processes (BranchSolver's workers, GeneticSolver's islands)
+# have in common: the best tour any of the processes has found, kept in shared memory so each of them can publish
+# to it and the parent can pass it on to on_improvement while it waits; a flag telling them all to stop (when
+# on_improvement says so); and a queue the processes put their results on at the end
+
+# seconds past the deadline the parent waits for a process before giving up on it
+GRACE = 10.0
+# seconds between the parent's looks at the shared best tour, when there's an on_improvement to tell
+IMPROVEMENT_POLL = 0.1
+
+# the shared dict handed to every process, plus whatever extra entries the solver needs
+# starts out with best_tour (a permutation) as the best if it's given
+def newShared(ncities, best_cost=math.inf, best_tour=None, **extra):
+  shared = {
+    'lock': multiprocessing.Lock(),
+    'best_cost': multiprocessing.RawValue('d', best_cost),
+    'best_tour': multiprocessing.RawArray('i', ncities),
+    'stop': multiprocessing.RawValue('b', 0),
+    'results': multiprocessing.Queue(),
+  }
+  if best_tour is not None:
+    shared['best_tour'][:] = [int(i) for i in best_tour]
+  shared.update(extra)
+  return shared
+
+# a SearchStats for a process to record into, timed from the same start as stats so its improvements line up
+# with the parent's when they're merged back
+def processStats(stats):
+  process_stats = SearchStats(enabled=stats.enabled)
+  process_stats.start_time = stats.start_time
+  return process_stats
+
+# in a process: make solution the shared best if it beats it, returns whether it did
+def publishBest(shared, solution):
+  if solution.cost >= shared['best_cost'].value:
+    return False
+  with shared['lock']:
+    if solution.cost >= shared['best_cost'].value:
+      return False
+    shared['best_cost'].value = solution.cost
+    shared['best_tour'][:] = [int(i) for i in solution.perm]
+  return True
+
+# in the parent: the shared best as a TSPSolution if it's cheaper than cost, otherwise None
+def sharedBest(shared, scenario, cost):
+  if shared['best_cost'].value >= cost:
+    return None
+  with shared['lock']:
+    tour = list(shared['best_tour'])
+  return TSPSolution.fromPermutation(scenario, tour)
+
+# in the parent: wait for a result from each of processes and hand it to on_result
+# collect() is called whenever the processes may have published a better tour: every IMPROVEMENT_POLL seconds
+# while waiting if poll is set, and before each result (a process publishes its best before it reports).  Gives
+# up GRACE seconds past the deadline on any process that hasn't reported (one that died: its result is lost but
+# any tour it published isn't)
+def gatherResults(shared, processes, deadline, on_result, collect, poll=False):
+  n_reported = 0
+  give_up = deadline + GRACE
+  while n_reported < len(processes):
+    timeout = max(0.0, give_up - time.time())
+    if poll:
+      timeout = min(timeout, IMPROVEMENT_POLL)
+    try:
+      result = shared['results'].get(timeout=timeout)
+    except queue.Empty:
+      if time.time() >= give_up:
+        break
+      collect()
+      continue
+    n_reported += 1
+    collect()
+    on_result(result)
+  collect()
+
+# wait for processes to exit, terminating any still running GRACE seconds later
+def joinProcesses(processes):
+  for process in processes:
+    process.join(timeout=GRACE)
+    if process.is_alive():
+      process.terminate()
@@ -264,7 +264,7 @@ class Proj5GUI( QMainWindow ):
 		self.view.repaint()
 
 
-	def displaySolution( self ) :						# what about calling this somehow every time a new bssf is found?
+	def displaySolution( self ) :
 		self.view.clearEdges([(64,64,255)])				# get rid of edge labels but not point labels
 		if self._solution:
 			self.addCities()
@@ -282,6 +282,14 @@ class Proj5GUI( QMainWindow ):
 		self.view.repaint()
 
 
+	# called by the solvers with each new bssf while they run, so the best tour so far is drawn straight away
+	def showImprovement( self, solution ):
+		self._solution = solution
+		self.tourCost.setText( '{}'.format(solution.cost) )
+		self.displaySolution()
+		QApplication.processEvents()
+		return False
+
 	def randSeedClicked(self):
 		new_seed = random.randint(0, self._MAX_SEED-1)
 		self.curSeed.setText( '{}'.format(new_seed) )
@@ -303,7 +311,7 @@ class Proj5GUI( QMainWindow ):
 		#self.view.repaint()
 		#app.processEvents()
 		solve_func = 'self.solver.'+self.ALGORITHMS[self.algDropDown.currentIndex()][1]
-		results = eval(solve_func)(time_allowance=max_time )
+		results = eval(solve_func)(time_allowance=max_time, on_improvement=self.showImprovement )
 		if results:
 			self.statusBar.showMessage('')
 			self.numSolutions.setText( '{}'.format(results['count']) )
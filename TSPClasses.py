@@ -3,29 +3,200 @@
 
 import math
 import numpy as np
+import os
 import random
+import struct
 import time
 
 
 
 class TSPSolution:
-	def __init__( self, listOfCities):
-		self.route = listOfCities
+	def __init__( self, listOfCities ):
+		self._scenario = listOfCities[0]._scenario
+		self._perm = np.array( [city._index for city in listOfCities], dtype=np.intp )
+		self._route = listOfCities
+		self._prefix_sums = None
 		self.cost = self._costOfRoute()
-		#print( [c._index for c in listOfCities] )
+
+	''' <summary>
+		Build a solution straight from an array of city indices.  This is the
+		cheap path for the solvers: the list of City objects is only built if
+		something (the GUI, enumerateEdges) asks for route.
+		</summary> '''
+	@classmethod
+	def fromPermutation( cls, scenario, perm ):
+		solution = cls.__new__( cls )
+		solution._scenario = scenario
+		solution._perm = np.array( perm, dtype=np.intp )
+		solution._route = None
+		solution._prefix_sums = None
+		solution.cost = solution._costOfRoute()
+		return solution
+
+	@property
+	def route( self ):
+		if self._route is None:
+			cities = self._scenario.getCities()
+			self._route = [cities[i] for i in self._perm]
+		return self._route
+
+	@property
+	def perm( self ):
+		return self._perm
 
 	def _costOfRoute( self ):
-		cost = 0
-		#print('cost = ',cost)
-		last = self.route[0]
-		for city in self.route[1:]:
-			#print('cost increasing by {} for leg {} to {}'.format(last.costTo(city),last._name,city._name))
-			cost += last.costTo(city)
-			last = city
-		#print('cost increasing by {} for leg {} to {}'.format(self.route[-1].costTo(self.route[0]),self.route[-1]._name,self.route[0]._name))
-		cost += self.route[-1].costTo( self.route[0] )
-		#print('cost = ',cost)
-		return cost
+		# One fancy-indexed gather of every leg (including the closing one) out
+		# of the scenario's cost matrix
+		costs = self._scenario.getCostMatrix()
+		legs = costs[self._perm, np.concatenate( (self._perm[1:], self._perm[:1]) )]
+		# Kept apart so the move deltas below can update the cost in O(1)
+		self._finite_cost = legs.sum()
+		self._infinite_legs = 0
+		if self._finite_cost == np.inf:
+			infinite = np.isinf( legs )
+			self._finite_cost = legs[~infinite].sum()
+			self._infinite_legs = int(infinite.sum())
+		return self._costFromParts()
+
+	def _costFromParts( self ):
+		if self._infinite_legs > 0:
+			return np.inf
+		return int(self._finite_cost)
+
+
+	''' <summary>
+		Move evaluation.  Each *Delta method returns how much the tour cost
+		would change if the move were applied, in O(1) and without touching
+		the tour.  With Hard mode's missing edges, a move that adds more
+		infinite legs than it removes returns np.inf, one that removes more
+		than it adds returns -np.inf, and otherwise the change in the finite
+		part of the cost is returned.  Positions are indices into perm.
+		The matching apply* methods make the move and update cost.
+		</summary> '''
+
+	# Compare the legs a move removes with the legs it adds, each given as
+	# (finite sum, number of infinite legs)
+	@staticmethod
+	def _delta( removed, added ):
+		if added[1] > removed[1]:
+			return np.inf
+		if added[1] < removed[1]:
+			return -np.inf
+		return float(added[0] - removed[0])
+
+	def _legs( self, pairs ):
+		costs = self._scenario.getCostMatrix()
+		finite = 0.0
+		infinite = 0
+		for src, dst in pairs:
+			cost = costs[src, dst]
+			if cost == np.inf:
+				infinite += 1
+			else:
+				finite += cost
+		return finite, infinite
+
+	# Prefix sums over the legs in tour order (forward) and against it
+	# (backward), split into finite sums and infinite-leg counts so that an
+	# infinite leg never turns a difference of sums into nan.  Built lazily
+	# after each change, so reversals evaluate in O(1) amortized.
+	def _prefixSums( self ):
+		if self._prefix_sums is None:
+			costs = self._scenario.getCostMatrix()
+			sums = []
+			for legs in (costs[self._perm[:-1], self._perm[1:]], costs[self._perm[1:], self._perm[:-1]]):
+				infinite = np.isinf( legs )
+				finite = np.concatenate( ([0.0], np.cumsum( np.where( infinite, 0.0, legs ) )) )
+				count = np.concatenate( ([0], np.cumsum( infinite )) )
+				sums.append( (finite, count) )
+			self._prefix_sums = sums
+		return self._prefix_sums
+
+	def _changed( self, removed, added ):
+		self._finite_cost += added[0] - removed[0]
+		self._infinite_legs += added[1] - removed[1]
+		self.cost = self._costFromParts()
+		self._route = None
+		self._prefix_sums = None
+
+	# Legs touching positions i and j before and after swapping those two cities
+	def _swapLegs( self, i, j ):
+		n = len(self._perm)
+		p = self._perm
+		edges = {(i-1) % n, i, (j-1) % n, j}
+		def city( pos ):
+			pos = pos % n
+			return p[j] if pos == i else p[i] if pos == j else p[pos]
+		removed = self._legs( [(p[e], p[(e+1) % n]) for e in edges] )
+		added = self._legs( [(city(e), city(e+1)) for e in edges] )
+		return removed, added
+
+	def swapDelta( self, i, j ):
+		if i == j:
+			return 0.0
+		return self._delta( *self._swapLegs( i, j ) )
+
+	def applySwap( self, i, j ):
+		if i == j:
+			return
+		removed, added = self._swapLegs( i, j )
+		self._perm[i], self._perm[j] = self._perm[j], self._perm[i]
+		self._changed( removed, added )
+
+	# Moving the segment perm[i..j] (i <= j, not wrapping) to sit between
+	# positions k and k+1, keeping its direction.  k must be outside i-1..j
+	# (mod n).
+	def _insertLegs( self, i, j, k ):
+		n = len(self._perm)
+		p = self._perm
+		before, after = p[(i-1) % n], p[(j+1) % n]
+		removed = self._legs( [(before, p[i]), (p[j], after), (p[k], p[(k+1) % n])] )
+		added = self._legs( [(before, after), (p[k], p[i]), (p[j], p[(k+1) % n])] )
+		return removed, added
+
+	def insertDelta( self, i, j, k ):
+		return self._delta( *self._insertLegs( i, j, k ) )
+
+	def applyInsert( self, i, j, k ):
+		removed, added = self._insertLegs( i, j, k )
+		segment = self._perm[i:j+1].copy()
+		rest = np.concatenate( (self._perm[:i], self._perm[j+1:]) )
+		at = k + 1 if k < i else k - len(segment) + 1
+		self._perm = np.concatenate( (rest[:at], segment, rest[at:]) )
+		self._changed( removed, added )
+
+	# Reversing perm[i..j] (i <= j) turns its internal legs around, which is
+	# where the asymmetric costs come in: the forward legs are swapped for
+	# the backward ones, read off the prefix sums.
+	def _reverseLegs( self, i, j ):
+		n = len(self._perm)
+		p = self._perm
+		(fwd, fwd_inf), (bwd, bwd_inf) = self._prefixSums()
+		inner_removed = (fwd[j] - fwd[i], fwd_inf[j] - fwd_inf[i])
+		inner_added = (bwd[j] - bwd[i], bwd_inf[j] - bwd_inf[i])
+		if j - i == n - 1:
+			# The whole tour, so only the closing leg changes direction as well
+			outer_removed = self._legs( [(p[j], p[i])] )
+			outer_added = self._legs( [(p[i], p[j])] )
+		else:
+			before, after = p[(i-1) % n], p[(j+1) % n]
+			outer_removed = self._legs( [(before, p[i]), (p[j], after)] )
+			outer_added = self._legs( [(before, p[j]), (p[i], after)] )
+		removed = (inner_removed[0] + outer_removed[0], inner_removed[1] + outer_removed[1])
+		added = (inner_added[0] + outer_added[0], inner_added[1] + outer_added[1])
+		return removed, added
+
+	def reverseDelta( self, i, j ):
+		if i >= j:
+			return 0.0
+		return self._delta( *self._reverseLegs( i, j ) )
+
+	def applyReverse( self, i, j ):
+		if i >= j:
+			return
+		removed, added = self._reverseLegs( i, j )
+		self._perm[i:j+1] = self._perm[i:j+1][::-1].copy()
+		self._changed( removed, added )
 
 	def enumerateEdges( self ):
 		elist = []
@@ -61,32 +232,38 @@ def nameForInt( num ):
 class Scenario:
 
 	HARD_MODE_FRACTION_TO_REMOVE = 0.20 # Remove 20% of the edges
+	DEFAULT_NEIGHBORS = 10 # Candidate list length for getNeighbors
 
+	''' <summary>
+		city_locations can be the GUI's QPointFs or any plain sequence of (x, y)
+		pairs (an (n,2) array works too), so scenarios can be built without Qt.
+		The cities themselves live in the contiguous _xs, _ys and _elevations
+		arrays; City objects are just views onto an index (see getCities).
+		</summary> '''
 	def __init__( self, city_locations, difficulty, rand_seed ):
 		self._difficulty = difficulty
+		self._rand_seed = rand_seed
+
+		if isinstance( city_locations, np.ndarray ):
+			points = city_locations.astype( float ).reshape( (-1,2) )
+		else:
+			points = np.array( [(pt.x(), pt.y()) if callable(getattr(pt, 'x', None)) else (pt[0], pt[1]) \
+								for pt in city_locations], dtype=float ).reshape( (-1,2) )
+		ncities = len(points)
+		self._xs = np.ascontiguousarray( points[:,0] )
+		self._ys = np.ascontiguousarray( points[:,1] )
 
 		if difficulty == "Normal" or difficulty == "Hard":
-			self._cities = [City( pt.x(), pt.y(), \
-								  random.uniform(0.0,1.0) \
-								) for pt in city_locations]
+			self._elevations = np.array( [random.uniform(0.0,1.0) for _ in range(ncities)], dtype=float )
 		elif difficulty == "Hard (Deterministic)":
 			random.seed( rand_seed )
-			self._cities = [City( pt.x(), pt.y(), \
-								  random.uniform(0.0,1.0) \
-								) for pt in city_locations]
+			self._elevations = np.array( [random.uniform(0.0,1.0) for _ in range(ncities)], dtype=float )
 		else:
-			self._cities = [City( pt.x(), pt.y() ) for pt in city_locations]
-
+			self._elevations = np.zeros( ncities )
 
-		num = 0
-		for city in self._cities:
-			#if difficulty == "Hard":
-			city.setScenario(self)
-			city.setIndexAndName( num, nameForInt( num+1 ) )
-			num += 1
+		self._resetDerived()
 
 		# Assume all edges exists except self-edges
-		ncities = len(self._cities)
 		self._edge_exists = ( np.ones((ncities,ncities)) - np.diag( np.ones((ncities)) ) ) > 0
 
 		#print( self._edge_exists )
@@ -95,66 +272,296 @@ class Scenario:
 		elif difficulty == "Hard (Deterministic)":
 			self.thinEdges(deterministic=True)
 
+	def __len__( self ):
+		return len(self._xs)
+
+	# Forget everything built from the cities and edges (City views, cost
+	# matrix, candidate lists and the DistanceCache), so it is rebuilt on
+	# first use.  Every way a scenario comes to be or has its edges changed
+	# goes through here.
+	def _resetDerived( self ):
+		self._cities = None
+		self._cost_matrix = None
+		self._neighbors = {}
+		self._distance_cache = None # see DistanceCache.forScenario
+
+	# The City views are built on first use
 	def getCities( self ):
+		if self._cities is None:
+			self._cities = [City( self, i ) for i in range(len(self))]
 		return self._cities
 
+	# Leave the City views out of pickles (they are rebuilt on demand), which
+	# keeps shipping a scenario to a worker process down to its arrays
+	def __getstate__( self ):
+		state = self.__dict__.copy()
+		state['_cities'] = None
+		return state
+
+	# Built on first use, so generating a scenario doesn't pay for it up front
+	def getCostMatrix( self ):
+		if self._cost_matrix is None:
+			self._buildCostMatrix()
+		return self._cost_matrix
+
+	''' <summary>
+		Candidate lists: for every city, the indices of its k cheapest
+		outgoing and k cheapest incoming edges, cheapest first.  Rows are
+		padded with -1 where a city has fewer than k feasible edges that way.
+		Computed on first use for each k and kept.
+		</summary>
+		<returns>(outgoing, incoming), two n x k integer arrays</returns> '''
+	def getNeighbors( self, k=DEFAULT_NEIGHBORS ):
+		if k not in self._neighbors:
+			costs = self.getCostMatrix()
+			self._neighbors[k] = ( self._nearest( costs, k ), self._nearest( costs.T, k ) )
+		return self._neighbors[k]
+
+	# k cheapest columns of every row, cheapest first and ties in index
+	# order (so the lowest index wins, as a strict < scan would have it),
+	# in chunks of rows to keep the temporaries small on big instances
+	@staticmethod
+	def _nearest( costs, k, chunk=1024 ):
+		ncities = costs.shape[0]
+		k = max( 0, min( k, ncities-1 ) )
+		nearest = np.full( (ncities,k), -1, dtype=np.intp )
+		if k == 0:
+			return nearest
+
+		for start in range( 0, ncities, chunk ):
+			rows = np.asarray( costs[start:start+chunk] )
+			# everything finite up to the k-th cost, ties at the k-th place included
+			kth = np.partition( rows, k-1, axis=1 )[:,k-1:k]
+			row, col = np.nonzero( (rows <= kth) & ~np.isinf( rows ) )
+			order = np.lexsort( (col, rows[row,col], row) )
+			row, col = row[order], col[order]
+			rank = np.arange( len(row) ) - np.searchsorted( row, row )
+			keep = rank < k
+			nearest[start+row[keep], rank[keep]] = col[keep]
+		return nearest
+
+	''' <summary>
+		Build the full asymmetric cost matrix in one vectorized pass.  Entry
+		[i,j] is exactly what City.costTo used to compute for city i to city j,
+		and np.inf where the edge doesn't exist (including self-edges).  The
+		array is read-only so solvers can share it without copying.
+		</summary> '''
+	def _buildCostMatrix( self ):
+		xs = self._xs
+		ys = self._ys
+		elevations = self._elevations
+
+		# Euclidean Distance
+		cost = np.sqrt( (xs[np.newaxis,:] - xs[:,np.newaxis])**2 +
+						(ys[np.newaxis,:] - ys[:,np.newaxis])**2 )
+
+		# For Medium and Hard modes, add in an asymmetric cost (in easy mode it is zero).
+		if not self._difficulty == 'Easy':
+			cost += elevations[np.newaxis,:] - elevations[:,np.newaxis]
+			np.maximum( cost, 0.0, out=cost )
+
+		cost = np.ceil( cost * City.MAP_SCALE )
+		cost[~self._edge_exists] = np.inf
+		cost.flags.writeable = False
+		self._cost_matrix = cost
+
+
+	''' <summary>
+		Binary scenario file layout (all little-endian):
+		  header     FILE_HEADER (magic, version, ncities, flags, rand_seed, difficulty)
+		  x, y       float64[n] each
+		  elevation  float64[n]
+		  edges      _edge_exists packed 8 edges to a byte (np.packbits)
+		  costs      float64[n,n], only if FLAG_HAS_COSTS is set
+		Every section starts on a FILE_ALIGNMENT boundary so it can be
+		memory-mapped straight into an array.
+		</summary> '''
+	FILE_MAGIC = b'TSPSCN\x00\x00'
+	FILE_VERSION = 1
+	FILE_HEADER = struct.Struct( '<8sIQIq64s' )
+	FILE_ALIGNMENT = 64
+	FLAG_HAS_COSTS = 0x1
+
+	@classmethod
+	def _fileSections( cls, ncities, has_costs ):
+		sizes = [('x', 8*ncities), ('y', 8*ncities), ('elevation', 8*ncities),
+				 ('edges', (ncities*ncities + 7) // 8)]
+		if has_costs:
+			sizes.append( ('costs', 8*ncities*ncities) )
+
+		sections = {}
+		offset = cls.FILE_HEADER.size
+		for name, size in sizes:
+			offset += -offset % cls.FILE_ALIGNMENT
+			sections[name] = offset
+			offset += size
+		return sections
+
+	''' <summary>
+		Save this scenario to a binary file that Scenario.load can memory-map.
+		The file is written next to its destination and renamed into place, so
+		other processes never see a partially written scenario.
+		</summary> '''
+	def save( self, filename, include_costs=True ):
+		ncities = len(self)
+		sections = self._fileSections( ncities, include_costs )
+		flags = self.FLAG_HAS_COSTS if include_costs else 0
+		rand_seed = -1 if self._rand_seed is None else int(self._rand_seed)
+
+		arrays = {
+			'x': np.asarray( self._xs, dtype='<f8' ),
+			'y': np.asarray( self._ys, dtype='<f8' ),
+			'elevation': np.asarray( self._elevations, dtype='<f8' ),
+			'edges': np.packbits( self._edge_exists, axis=None ),
+		}
+		if include_costs:
+			arrays['costs'] = np.asarray( self.getCostMatrix(), dtype='<f8' )
+
+		tmp_filename = '{}.{}.tmp'.format( filename, os.getpid() )
+		with open( tmp_filename, 'wb' ) as f:
+			f.write( self.FILE_HEADER.pack( self.FILE_MAGIC, self.FILE_VERSION, ncities, flags,
+											rand_seed, self._difficulty.encode('utf-8') ) )
+			for name, offset in sections.items():
+				f.write( b'\x00' * (offset - f.tell()) )
+				arrays[name].tofile( f )
+		os.replace( tmp_filename, filename )
+
+	''' <summary>
+		Load a scenario written by Scenario.save.  The cost matrix, if the file
+		has one, is a read-only memory map of the file rather than an in-RAM
+		copy, so several processes can share one file's pages.  Otherwise it is
+		rebuilt from the coordinates.
+		</summary> '''
+	@classmethod
+	def load( cls, filename ):
+		with open( filename, 'rb' ) as f:
+			header = f.read( cls.FILE_HEADER.size )
+		if len(header) < cls.FILE_HEADER.size:
+			raise Exception('Not a scenario file: {}'.format(filename))
+		magic, version, ncities, flags, rand_seed, difficulty = cls.FILE_HEADER.unpack( header )
+		if magic != cls.FILE_MAGIC:
+			raise Exception('Not a scenario file: {}'.format(filename))
+		if version != cls.FILE_VERSION:
+			raise Exception('Unsupported scenario file version: {}'.format(version))
+
+		has_costs = bool(flags & cls.FLAG_HAS_COSTS)
+		sections = cls._fileSections( ncities, has_costs )
+
+		def section( name, dtype, shape ):
+			return np.memmap( filename, dtype=dtype, mode='r', offset=sections[name], shape=shape )
+
+		scenario = cls.__new__( cls )
+		scenario._difficulty = difficulty.rstrip(b'\x00').decode('utf-8')
+		scenario._rand_seed = None if rand_seed == -1 else rand_seed
+
+		scenario._xs = np.array( section( 'x', '<f8', (ncities,) ), dtype=float )
+		scenario._ys = np.array( section( 'y', '<f8', (ncities,) ), dtype=float )
+		scenario._elevations = np.array( section( 'elevation', '<f8', (ncities,) ), dtype=float )
+		scenario._resetDerived()
+
+		edges = section( 'edges', np.uint8, ((ncities*ncities + 7) // 8,) )
+		scenario._edge_exists = np.unpackbits( edges, count=ncities*ncities ).reshape( (ncities,ncities) ) > 0
 
-	def randperm( self, n ):				#isn't there a numpy function that does this and even gets called in Solver?
-		perm = np.arange(n)
-		for i in range(n):
-			randind = random.randint(i,n-1)
-			save = perm[i]
-			perm[i] = perm[randind]
-			perm[randind] = save
-		return perm
+		if has_costs:
+			scenario._cost_matrix = section( 'costs', '<f8', (ncities,ncities) )
+		return scenario
 
+
+	''' <summary>
+		Remove HARD_MODE_FRACTION_TO_REMOVE of the edges in one shot: every
+		removable edge is a flat index into _edge_exists and the whole set to
+		remove is sampled without replacement at once.  The deterministic mode
+		draws from its own generator seeded with the scenario's rand_seed, so
+		"Hard (Deterministic)" scenarios come out the same on every machine.
+		</summary> '''
 	def thinEdges( self, deterministic=False ):
-		ncities = len(self._cities)
+		ncities = len(self)
 		edge_count = ncities*(ncities-1) # can't have self-edge
-		num_to_remove = np.floor(self.HARD_MODE_FRACTION_TO_REMOVE*edge_count)
+		num_to_remove = int(np.floor(self.HARD_MODE_FRACTION_TO_REMOVE*edge_count))
+
+		if deterministic:
+			rng = np.random.default_rng( self._rand_seed )
+		else:
+			rng = np.random
 
-		#edge_exists = ( np.ones((ncities,ncities)) - np.diag( np.ones((ncities)) ) ) > 0
 		can_delete	= self._edge_exists.copy()
 
 		# Set aside a route to ensure at least one tour exists
-		route_keep = np.random.permutation( ncities )
-		if deterministic:
-			route_keep = self.randperm( ncities )
-		for i in range(ncities):
-			can_delete[route_keep[i],route_keep[(i+1)%ncities]] = False
-
-		# Now remove edges until 
-		while num_to_remove > 0:
-			if deterministic:
-				src = random.randint(0,ncities-1)
-				dst = random.randint(0,ncities-1)
-			else:
-				src = np.random.randint(ncities)
-				dst = np.random.randint(ncities)
-			if self._edge_exists[src,dst] and can_delete[src,dst]:
-				self._edge_exists[src,dst] = False
-				num_to_remove -= 1
+		route_keep = rng.permutation( ncities )
+		can_delete[route_keep, np.roll( route_keep, -1 )] = False
 
-		#print( self._edge_exists )
+		# Now remove edges, all at once
+		removable = np.flatnonzero( can_delete )
+		num_to_remove = min( num_to_remove, len(removable) )
+		removed = rng.choice( removable, size=num_to_remove, replace=False )
+		self._edge_exists.reshape(-1)[removed] = False
+
+		# Anything derived from the old edges is stale now
+		self._resetDerived()
+
+
+
+
+class DistanceCache:
+	''' <summary>
+		The scenario's costs and what the solvers derive from them, built once
+		per scenario and shared by every solver run on it.  Fetch it with
+		DistanceCache.forScenario: the cache is kept on the scenario itself
+		(so it goes away with the scenario) and is rebuilt if the scenario's
+		cost matrix has been replaced (e.g. by thinEdges).  Treat everything handed out here as read-only.
+		build_time is how long fetching the cost matrix took (0 if the
+		scenario had already built it), for instrumented runs to report.
+		</summary> '''
+	@classmethod
+	def forScenario( cls, scenario ):
+		cache = scenario._distance_cache
+		if cache is None or cache.costs is not scenario.getCostMatrix():
+			cache = cls( scenario )
+			scenario._distance_cache = cache
+		return cache
+
+	def __init__( self, scenario ):
+		self._scenario = scenario
+		start_time = time.time()
+		self.costs = scenario.getCostMatrix()
+		self.build_time = time.time() - start_time
+
+	def getScenario( self ):
+		return self._scenario
+
+	def getNeighbors( self, k=Scenario.DEFAULT_NEIGHBORS ):
+		return self._scenario.getNeighbors( k )
 
 
 
 
 class City:
-	def __init__( self, x, y, elevation=0.0 ):
-		self._x = x
-		self._y = y
-		self._elevation = elevation
-		self._scenario	= None
-		self._index = -1
-		self._name	= None
-
-	def setIndexAndName( self, index, name ):
-		self._index = index
-		self._name = name
+	''' <summary>
+		A lightweight view onto city number _index of its scenario.  The
+		coordinates and elevation are read from the scenario's arrays and the
+		name is made when asked for, so a City costs two references.
+		</summary> '''
+	__slots__ = ( '_scenario', '_index' )
 
-	def setScenario( self, scenario ):
+	def __init__( self, scenario, index ):
 		self._scenario = scenario
+		self._index = index
+
+	@property
+	def _x( self ):
+		return self._scenario._xs[self._index]
+
+	@property
+	def _y( self ):
+		return self._scenario._ys[self._index]
+
+	@property
+	def _elevation( self ):
+		return self._scenario._elevations[self._index]
+
+	@property
+	def _name( self ):
+		return nameForInt( self._index+1 )
 
 	''' <summary>
 		How much does it cost to get from this city to the destination?
@@ -164,26 +571,10 @@ class City:
 		</summary> '''
 	MAP_SCALE = 1000.0
 	def costTo( self, other_city ):
-
-		assert( type(other_city) == City )
-
-		# In hard mode, remove edges; this slows down the calculation...
-		# Use this in all difficulties, it ensures INF for self-edge
-		if not self._scenario._edge_exists[self._index, other_city._index]:
-			#print( 'Edge ({},{}) doesn\'t exist'.format(self._index,other_city._index) )
+		# The scenario precomputes every edge (see Scenario._buildCostMatrix),
+		# missing edges and self-edges are already INF there
+		cost = self._scenario.getCostMatrix()[self._index, other_city._index]
+		if cost == np.inf:
 			return np.inf
-
-		# Euclidean Distance
-		cost = math.sqrt( (other_city._x - self._x)**2 +
-						  (other_city._y - self._y)**2 )
-
-		# For Medium and Hard modes, add in an asymmetric cost (in easy mode it is zero).
-		if not self._scenario._difficulty == 'Easy':
-			cost += (other_city._elevation - self._elevation)
-			if cost < 0.0:
-				cost = 0.0
-		#cost *= SCALE_FACTOR
-
-
-		return int(math.ceil(cost * self.MAP_SCALE))
+		return int(cost)
 
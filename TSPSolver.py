@@ -1,14 +1,6 @@
 #!/usr/bin/python3
 
-from which_pyqt import PYQT_VER
-if PYQT_VER == 'PYQT5':
-	from PyQt5.QtCore import QLineF, QPointF
-elif PYQT_VER == 'PYQT4':
-	from PyQt4.QtCore import QLineF, QPointF
-else:
-	raise Exception('Unsupported Version of PyQt: {}'.format(PYQT_VER))
-
-
+# Deliberately no Qt imports in here: the solvers also run headless (see BatchRunner.py)
 
 
 import time
@@ -20,14 +12,46 @@ import itertools
 from GreedySolver import GreedySolver
 from GeneticSolver import GeneticSolver
 from BranchSolver import BranchSolver
+from HeldKarpSolver import HeldKarpSolver
+from Instrumentation import SearchStats
 
 
 class TSPSolver:
+	# the heuristics branchAndBound can take its initial BSSF from
+	WARM_STARTS = ( 'greedy', 'fancy' )
+
 	def __init__( self, gui_view ):
 		self._scenario = None
+		self._distances = None
 
+	''' <summary>
+		Also fetches the scenario's DistanceCache, so the cost matrix and the
+		structures derived from it are built once and shared by every entry
+		point below, however many times they are run on this scenario.
+		</summary> '''
 	def setupWithScenario( self, scenario ):
+		if scenario is not self._scenario:
+			self._distances = None
 		self._scenario = scenario
+		if scenario is not None:
+			self._distances = DistanceCache.forScenario( scenario )
+
+	''' <summary>
+		Every entry point below takes stats, an Instrumentation.SearchStats to
+		record the run in (phase times, counters and rates, and a time stamped
+		trace of each improvement to the best tour); it comes back in the
+		results as stats.  Left as None nothing is recorded and stats is None.
+		They also take on_improvement, called with each new best TSPSolution as
+		soon as it is found; if it returns True the run stops early and returns
+		what it has.
+		</summary> '''
+	def _statsFor( self, stats ):
+		if stats is None:
+			return SearchStats( enabled=False )
+		# the cost matrix was built once for the scenario, charge it to the first run recorded
+		if 'matrix build' not in stats.phases:
+			stats.addTime( 'matrix build', self._distances.build_time )
+		return stats
 
 
 	''' <summary>
@@ -41,7 +65,8 @@ class TSPSolver:
 		algorithm</returns>
 	'''
 
-	def defaultRandomTour( self, time_allowance=60.0 ):
+	def defaultRandomTour( self, time_allowance=60.0, stats=None, on_improvement=None ):
+		stats = self._statsFor( stats )
 		results = {}
 		cities = self._scenario.getCities()
 		ncities = len(cities)
@@ -52,16 +77,18 @@ class TSPSolver:
 		while not foundTour and time.time()-start_time < time_allowance:
 			# create a random permutation
 			perm = np.random.permutation( ncities )
-			route = []
 			# Now build the route using the random permutation
-			for i in range( ncities ):
-				route.append( cities[ perm[i] ] )
-			bssf = TSPSolution(route)
+			bssf = TSPSolution.fromPermutation( self._scenario, perm )
 			count += 1
 			if bssf.cost < np.inf:
 				# Found a valid route
 				foundTour = True
+				stats.improvement( bssf.cost, permutations=count )
+				if on_improvement is not None:
+					on_improvement( bssf )
 		end_time = time.time()
+		stats.addTime( 'search', end_time - start_time )
+		stats.count( 'permutations', count )
 		results['cost'] = bssf.cost if foundTour else math.inf
 		results['time'] = end_time - start_time
 		results['count'] = count
@@ -69,6 +96,7 @@ class TSPSolver:
 		results['max'] = None
 		results['total'] = None
 		results['pruned'] = None
+		results['stats'] = stats.toDict()
 		return results
 
 
@@ -84,9 +112,10 @@ class TSPSolver:
 		algorithm</returns>
 	'''
 
-	def greedy( self,time_allowance=60.0 ):
+	def greedy( self,time_allowance=60.0, stats=None, on_improvement=None ):
 		cities = self._scenario.getCities()
-		solver = GreedySolver(cities, time_allowance)
+		solver = GreedySolver(cities, time_allowance, distances=self._distances, stats=self._statsFor(stats),
+							  on_improvement=on_improvement)
 		results = solver.solve(0)
 		return results
 
@@ -96,20 +125,69 @@ class TSPSolver:
 		<returns>results dictionary for GUI that contains three ints: cost of best solution,
 		time spent to find best solution, total number solutions found during search (does
 		not include the initial BSSF), the best solution found, and three more ints:
-		max queue size, total number of states created, and number of pruned states.</returns>
+		max queue size, total number of states created, and number of pruned states.
+		Also peak_memory (estimated bytes) and, when a memory_budget in bytes is given,
+		the number of states discarded to stay inside it.  n_workers > 1 spreads the
+		search over that many processes.  bound selects the lower bound states are pruned
+		on: 'reduction' or the stronger (but slower per state) 'assignment'.
+		The initial BSSF comes from running the warm_start solver ('greedy', 'fancy' or
+		None for no warm start) with warm_start_share of the time allowance; its cost is
+		reported as initial_cost and the time it took as initial_time.  checkpoint_file
+		saves the search every checkpoint_interval seconds, and resume_from carries on from
+		such a file with a fresh time_allowance (total, pruned and count carry over).</returns>
 	'''
 
-	def branchAndBound( self, time_allowance=60.0 ):
+	def branchAndBound( self, time_allowance=60.0, memory_budget=None, n_workers=1, bound='reduction',
+						warm_start='greedy', warm_start_share=0.1, checkpoint_file=None,
+						checkpoint_interval=BranchSolver.CHECKPOINT_INTERVAL, resume_from=None, stats=None,
+						on_improvement=None ):
 		results = {}
 		cities = self._scenario.getCities()
+		stats = self._statsFor( stats )
+		start_time = time.time()
+
+		initial_solution = None
+		if warm_start != None:
+			if warm_start not in self.WARM_STARTS:
+				raise Exception('Unsupported warm start: {}'.format(warm_start))
+			# the heuristic records nothing of its own here, its run shows up as the warm start phase and
+			# its tour's cost as initial_cost
+			with stats.phase( 'warm start' ):
+				initial_solution = getattr(self, warm_start)(time_allowance=time_allowance*warm_start_share)['soln']
+		initial_time = time.time() - start_time
 
 		# I've moved most of the work out to the BranchSolver class declared in BranchSolver.py
-		bs = BranchSolver(cities, time_allowance=time_allowance)
-		results = bs.solve(0)
+		# (the warm start's tour reaches on_improvement from there, as the first bssf)
+		bs = BranchSolver(cities, time_allowance=max(0.0, time_allowance - initial_time), distances=self._distances,
+						  memory_budget=memory_budget, n_workers=n_workers, bound=bound,
+						  initial_solution=initial_solution, checkpoint_file=checkpoint_file,
+						  checkpoint_interval=checkpoint_interval, stats=stats, on_improvement=on_improvement)
+		results = bs.solve(0, resume_from=resume_from)
+		results['time'] += initial_time
+		results['initial_time'] = initial_time
 
 		return results
 
 
+	''' <summary>
+		This is the entry point for the exact Held-Karp dynamic program, for small
+		scenarios (up to about 20 cities) where a proven optimum is needed.
+		</summary>
+		<returns>results dictionary for GUI that contains three ints: cost of the optimal
+		tour (inf if there is none or time ran out), time spent, 1 if a tour was found,
+		the tour, None for max, the number of dynamic program states for total, and None
+		for pruned.  Also memory, the estimated bytes needed.  Raises MemoryError without
+		running if that is more than memory_limit.</returns>
+	'''
+
+	def heldKarp( self, time_allowance=60.0, memory_limit=HeldKarpSolver.DEFAULT_MEMORY_LIMIT, stats=None,
+				  on_improvement=None ):
+		cities = self._scenario.getCities()
+		solver = HeldKarpSolver(cities, time_allowance=time_allowance, memory_limit=memory_limit,
+								distances=self._distances, stats=self._statsFor(stats), on_improvement=on_improvement)
+		return solver.solve(0)
+
+
 
 	''' <summary>
 		This is the entry point for the algorithm you'll write for your group project.
@@ -117,12 +195,17 @@ class TSPSolver:
 		<returns>results dictionary for GUI that contains three ints: cost of best solution,
 		time spent to find best solution, total number of solutions found during search, the
 		best solution found.  You may use the other three field however you like.
+		n_islands > 1 evolves that many populations in parallel processes with
+		migration between them (the island model), count is then summed over them.
+		local_search polishes each child with 2-opt and Or-opt moves before it is
+		scored (fewer generations, each much better).
 		algorithm</returns>
 	'''
 
-	def fancy( self,time_allowance=60.0 ):
+	def fancy( self,time_allowance=60.0, stats=None, on_improvement=None, n_islands=1, local_search=False ):
 		cities = self._scenario.getCities()
-		solver = GeneticSolver(cities, timeout=time_allowance)
+		solver = GeneticSolver(cities, timeout=time_allowance, distances=self._distances, stats=self._statsFor(stats),
+							   on_improvement=on_improvement, n_islands=n_islands, local_search=local_search)
 		return solver.solve()
 
 
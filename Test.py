@@ -1,40 +1,11 @@
-from TSPClasses import *
-from TSPSolver import TSPSolver
-import Proj5GUI
+from BatchRunner import DEFAULT_SOLVERS, ResultWriter, generateNetwork, gridCells, runGrid
 
-import random
-import csv
+import os
 import time
 
-from PyQt5.QtWidgets import *
-from PyQt5.QtGui import *
-from PyQt5.QtCore import *
-
-data_range = {'x': [-1.5, 1.5], 'y': [-1.0, 1.0]}
+# no Qt needed here, the scenarios are built from plain coordinates by BatchRunner
 diff = "Hard (Deterministic)"
-
-def newPoints(seed, npoints):
-  random.seed( seed )
-
-  ptlist = []
-  RANGE = data_range
-  xr = data_range['x']
-  yr = data_range['y']
-  while len(ptlist) < npoints:
-    x = random.uniform(0.0,1.0)
-    y = random.uniform(0.0,1.0)
-    if True:
-      xval = xr[0] + (xr[1]-xr[0])*x
-      yval = yr[0] + (yr[1]-yr[0])*y
-      ptlist.append( QPointF(xval,yval) )
-  return ptlist
-
-def generateNetwork(seed, n):
-  points = newPoints(seed, n) # uses current rand seed
-  rand_seed = seed
-  scenario = Scenario( city_locations=points, difficulty=diff, rand_seed=rand_seed )
-
-  return scenario
+scenario_dir = "scenarios"
 
 
 numbers = [15, 30, 60, 100, 200, 300]
@@ -43,58 +14,29 @@ seeds = [101, 202, 303, 404, 505]
 # seeds = [20, 121]
 MAX_TIME = 120
 
-results = []
-
-filename = "testoutput_" + str(int(time.time())) + ".csv"
-
-csvfile = open(filename, 'w', newline='')
-csvwriter = csv.writer(csvfile, delimiter=' ',
-                            quotechar='|', quoting=csv.QUOTE_MINIMAL)
-
-csvwriter.writerow(['n,','seed,', 'random_time,', 'random_cost,', 'greedy_time,', 'greedy_cost,', 'bb_time,', 'bb_cost,', 'gen_time,', 'gen_cost,'])
-
-n_test_sets = len(seeds) * len(numbers)
+# how many (n, seed, solver) cells to run at once
+WORKERS = os.cpu_count()
 
-i = 0
-for n in numbers:
-  for seed in seeds:
-    i += 1
-    scenario = generateNetwork(seed, n)
-    solver = TSPSolver(None)
-    solver.setupWithScenario(scenario)
+if __name__ == '__main__':
+  filename = "testoutput_" + str(int(time.time()))
 
-    print("test set", i, "of", n_test_sets)
-    print("seed", seed)
-    print("n", n)
-    ran_result = solver.defaultRandomTour(time_allowance=MAX_TIME)
-    greedy_result = solver.greedy(time_allowance=MAX_TIME)
-    bb_result = solver.branchAndBound(time_allowance=MAX_TIME)
-    gen_result = solver.fancy(time_allowance=MAX_TIME)
+  # generate (or load) every scenario once so the worker processes just read them from disk
+  for n in numbers:
+    for seed in seeds:
+      generateNetwork(seed, n, diff, scenario_dir)
 
-    row = []
-    row.append(n)
-    row.append(',')
-    row.append(seed)
-    row.append(',')
-    row.append(ran_result['time'])
-    row.append(',')
-    row.append(ran_result['cost'])
-    row.append(',')
-    row.append(greedy_result['time'])
-    row.append(',')
-    row.append(greedy_result['cost'])
-    row.append(',')
-    row.append(bb_result['time'])
-    row.append(',')
-    row.append(bb_result['cost'])
-    row.append(',')
-    row.append(gen_result['time'])
-    row.append(',')
-    row.append(gen_result['cost'])
+  cells = gridCells(numbers, seeds, [MAX_TIME], DEFAULT_SOLVERS, diff, scenario_dir)
+  print("running", len(cells), "test cells on", WORKERS, "workers")
 
-    print(row)
-    csvwriter.writerow(row)
+  csvfile = open(filename + ".csv", 'w', newline='')
+  jsonfile = open(filename + ".jsonl", 'w')
+  writer = ResultWriter(csvfile, jsonfile)
 
+  def report(row):
+    print(row['n'], row['seed'], row['solver'], row['status'], row['time'], row['cost'])
+    writer(row)
 
+  runGrid(cells, report, workers=WORKERS)
 
-csvfile.close()
+  csvfile.close()
+  jsonfile.close()